@@ -0,0 +1,106 @@
+"""Per-request overhead of the security-headers middleware.
+
+Drives a bare Starlette app in-process (no sockets, no server) through
+three stacks and prints the mean cost per request:
+
+    bare      no middleware, the floor
+    before    the previous BaseHTTPMiddleware implementation
+    after     the pure ASGI SecurityHeadersMiddleware from main.py
+
+main.py is imported with the in-memory Firebase fakes installed, so no
+credentials are needed:
+
+    python benchmarks/bench_middleware.py --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "task"))
+import fakes  # noqa: E402
+
+fakes.install()
+from main import SecurityHeadersMiddleware  # noqa: E402
+
+
+class LegacySecurityHeadersMiddleware(BaseHTTPMiddleware):
+    """The implementation SecurityHeadersMiddleware replaced, kept as the baseline"""
+
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Content-Security-Policy"] = "default-src 'self'"
+        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+        return response
+
+
+async def ping(request):
+    return PlainTextResponse("ok")
+
+
+def build_app(middleware_class=None) -> Starlette:
+    middleware = [Middleware(middleware_class)] if middleware_class else []
+    return Starlette(routes=[Route("/ping", ping)], middleware=middleware)
+
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/ping",
+    "raw_path": b"/ping",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [(b"host", b"bench")],
+    "client": ("127.0.0.1", 1234),
+    "server": ("bench", 80),
+}
+
+
+async def drive(app: Starlette, requests: int) -> float:
+    """Mean seconds per request over `requests` sequential in-process calls"""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # Warm up routing and middleware stack construction
+    for _ in range(200):
+        await app(dict(SCOPE), receive, send)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(SCOPE), receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+async def main(requests: int) -> None:
+    results = {
+        "bare": await drive(build_app(), requests),
+        "before": await drive(build_app(LegacySecurityHeadersMiddleware), requests),
+        "after": await drive(build_app(SecurityHeadersMiddleware), requests),
+    }
+    for name, seconds in results.items():
+        overhead = (seconds - results["bare"]) * 1e6
+        print(f"{name:<7} {seconds * 1e6:8.1f} us/request   overhead {overhead:7.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    asyncio.run(main(parser.parse_args().requests))
@@ -0,0 +1,120 @@
+"""Per-item JSON serialization cost of subscription responses.
+
+Serializes the same Firestore-shaped subscriptions (timestamps are
+DatetimeWithNanoseconds, as the client returns them) two ways and prints
+the mean cost per item:
+
+    single    one SubscriptionResponse to bytes: FastAPI's response_model
+              path (validate, serialize, jsonable_encoder, json.dumps) vs
+              the prebuilt main.subscription_adapter (validate + dump)
+    response  the same, plus building the Response with its ETag header on
+              both sides, as GET /api/subscriptions/{id} now returns it
+              (main.subscription_json); the ETag costs the same either way
+    list      a raw list of dicts: jsonable_encoder + json.dumps vs
+              orjson with main.json_default (FastJSONResponse)
+    ndjson    one line per item, as the streaming list emits them
+
+main.py is imported with the in-memory Firebase fakes installed:
+
+    python benchmarks/bench_serialization.py --items 1000 --rounds 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import timezone
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "task"))
+import fakes  # noqa: E402
+
+fakes.install()
+import main  # noqa: E402
+
+
+def subscriptions(count: int) -> list:
+    now = DatetimeWithNanoseconds.now(timezone.utc)
+    return [
+        {
+            "subscription_id": f"sub-{number:06d}",
+            "service_name": f"Service {number}",
+            "cost": 5.0 + number,
+            "billing_cycle": "Yearly" if number % 3 == 0 else "Monthly",
+            "next_renewal_date": "2030-01-01",
+            "status": "Active",
+            "user_id": "bench-user",
+            "created_at": now,
+            "updated_at": now,
+        }
+        for number in range(count)
+    ]
+
+
+def per_item(fn, items: int, rounds: int) -> float:
+    """Mean seconds per item over `rounds` calls of fn, each covering `items` items"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / (rounds * items)
+
+
+def run(items: int, rounds: int) -> None:
+    subs = subscriptions(items)
+    field = create_model_field(name="Response_get_subscription", type_=main.SubscriptionResponse)
+    loop = asyncio.new_event_loop()
+
+    async def serialize_all(with_response: bool):
+        for sub in subs:
+            content = await serialize_response(field=field, response_content=sub)
+            body = json.dumps(content).encode()
+            if with_response:
+                Response(content=body, media_type="application/json", headers={"ETag": main.subscription_version(sub)})
+
+    def fastapi_single():
+        loop.run_until_complete(serialize_all(False))
+
+    def fastapi_response():
+        loop.run_until_complete(serialize_all(True))
+
+    def adapter_single():
+        for sub in subs:
+            main.subscription_adapter.dump_json(main.subscription_adapter.validate_python(sub))
+
+    def adapter_response():
+        for sub in subs:
+            main.subscription_json(sub)
+
+    results = {
+        "single": (per_item(fastapi_single, items, rounds), per_item(adapter_single, items, rounds)),
+        "response": (per_item(fastapi_response, items, rounds), per_item(adapter_response, items, rounds)),
+        "list": (
+            per_item(lambda: json.dumps(jsonable_encoder(subs)).encode(), items, rounds),
+            per_item(lambda: main.FastJSONResponse(subs), items, rounds),
+        ),
+        "ndjson": (
+            per_item(lambda: [json.dumps(jsonable_encoder(sub)) + "\n" for sub in subs], items, rounds),
+            per_item(lambda: [main.dump_json(sub) + b"\n" for sub in subs], items, rounds),
+        ),
+    }
+    loop.close()
+
+    print(f"{'':<8} {'before':>14} {'after':>14} {'speedup':>8}")
+    for name, (before, after) in results.items():
+        print(f"{name:<8} {before * 1e6:9.2f} us/item {after * 1e6:6.2f} us/item {before / after:7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    run(args.items, args.rounds)
@@ -0,0 +1,417 @@
+"""In-memory stand-ins for the Firebase services main.py talks to.
+
+`install()` must run before `main` is imported. It sets the environment
+main.py requires and swaps the Firebase Admin entry points (credentials,
+app init, the async and sync Firestore clients and the `auth` functions
+main.py calls) for fakes. `identity_toolkit_transport()` provides an httpx
+transport that answers the Identity Toolkit REST calls.
+
+Every fake waits for a configurable latency so results resemble a real
+deployment. Async calls (Firestore, Identity Toolkit) use asyncio.sleep.
+The Admin SDK `auth` functions are synchronous, so their fakes block with
+time.sleep; main.py runs them in worker threads, as it does the real ones.
+Snapshot listeners deliver the initial result set once, from a thread, and
+do not report later writes.
+"""
+import asyncio
+import json
+import operator
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Optional
+
+import firebase_admin
+import httpx
+from firebase_admin import auth, credentials, firestore, firestore_async
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+
+
+@dataclass
+class Latency:
+    """Injected latency per dependency, in seconds, with +/- `jitter` spread"""
+    firestore: float = 0.005
+    auth: float = 0.002
+    identity_toolkit: float = 0.030
+    jitter: float = 0.2
+
+    def _sample(self, base: float) -> float:
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter))) if base else 0.0
+
+    async def wait(self, dependency: str) -> None:
+        delay = self._sample(getattr(self, dependency))
+        if delay:
+            await asyncio.sleep(delay)
+
+    def block(self, dependency: str) -> None:
+        delay = self._sample(getattr(self, dependency))
+        if delay:
+            time.sleep(delay)
+
+
+def _copy(data: dict) -> dict:
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in data.items()}
+
+
+def _resolve(value, current, now):
+    if isinstance(value, firestore.Increment):
+        return (current or 0) + value.value
+    if value is firestore.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, dict):
+        base = dict(current) if isinstance(current, dict) else {}
+        for key, nested in value.items():
+            base[key] = _resolve(nested, base.get(key), now)
+        return base
+    return value
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data: Optional[dict], update_time: Optional[datetime]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self) -> Optional[dict]:
+        return None if self._data is None else _copy(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id: str):
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def _store(self) -> dict:
+        return self._collection.docs
+
+    def _snapshot(self) -> FakeSnapshot:
+        data, update_time = self._store.get(self.id, (None, None))
+        return FakeSnapshot(self, data, update_time)
+
+    def _apply(self, kind: str, data: Optional[dict] = None, merge: bool = False, option=None) -> datetime:
+        existing, update_time = self._store.get(self.id, (None, None))
+        if option is not None and option.last_update_time != update_time:
+            raise FailedPrecondition("update time precondition failed")
+        # Update times carry nanoseconds, as the real client's do
+        now = DatetimeWithNanoseconds.now(timezone.utc)
+        if kind == "delete":
+            self._store.pop(self.id, None)
+        elif kind == "update":
+            if existing is None:
+                raise NotFound(f"No document to update: {self.id}")
+            self._store[self.id] = ({**existing, **_resolve(data, {}, now)}, now)
+        else:
+            base = existing if merge and existing is not None else {}
+            self._store[self.id] = (_resolve(data, base, now), now)
+        return now
+
+    async def get(self, transaction=None) -> FakeSnapshot:
+        await self._collection.client.latency.wait("firestore")
+        self._collection.client.reads += 1
+        return self._snapshot()
+
+    async def create(self, data: dict):
+        await self._collection.client.latency.wait("firestore")
+        if self.id in self._store:
+            raise AlreadyExists(f"Document already exists: {self.id}")
+        self._collection.client.writes += 1
+        self._apply("set", data)
+
+    async def set(self, data: dict, merge: bool = False):
+        await self._collection.client.latency.wait("firestore")
+        self._collection.client.writes += 1
+        self._apply("set", data, merge)
+
+    async def update(self, data: dict, option=None):
+        await self._collection.client.latency.wait("firestore")
+        self._collection.client.writes += 1
+        self._apply("update", data, option=option)
+
+    async def delete(self, option=None):
+        await self._collection.client.latency.wait("firestore")
+        self._collection.client.writes += 1
+        self._apply("delete", option=option)
+
+
+OPERATORS = {"==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), order=None, descending=False, after=None, limit=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = order
+        self._descending = descending
+        self._after = after
+        self._limit = limit
+
+    def _derive(self, **changes) -> "FakeQuery":
+        state = dict(
+            filters=self._filters, order=self._order, descending=self._descending,
+            after=self._after, limit=self._limit
+        )
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field: str, op: str, value) -> "FakeQuery":
+        if op not in OPERATORS:
+            raise NotImplementedError(f"Fake query does not support {op!r}")
+        return self._derive(filters=self._filters + [(field, OPERATORS[op], value)])
+
+    def order_by(self, field, direction=firestore.Query.ASCENDING) -> "FakeQuery":
+        return self._derive(order=str(field), descending=direction == firestore.Query.DESCENDING)
+
+    def start_after(self, values) -> "FakeQuery":
+        if isinstance(values, FakeSnapshot):
+            return self._derive(after=self._key(values.id, values._data))
+        (field, value), = values.items()
+        return self._derive(after=(getattr(value, "id", value),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._derive(limit=count)
+
+    def _key(self, doc_id: str, data: dict) -> tuple:
+        if self._order is None or self._order == "__name__":
+            return (doc_id,)
+        # Nulls sort before every other value, as in Firestore
+        value = data.get(self._order)
+        return (value is not None, value, doc_id)
+
+    def select(self, fields) -> "FakeQuery":
+        return self
+
+    def _matching(self) -> list:
+        docs = [
+            (doc_id, data, update_time)
+            for doc_id, (data, update_time) in self._collection.docs.items()
+            if all(
+                data.get(field) is not None and compare(data[field], value)
+                for field, compare, value in self._filters
+            )
+        ]
+        if self._order is not None:
+            if self._order != "__name__":
+                docs = [doc for doc in docs if self._order in doc[1]]
+            docs.sort(key=lambda doc: self._key(doc[0], doc[1]), reverse=self._descending)
+        if self._after is not None:
+            after = (lambda key: key < self._after) if self._descending else (lambda key: key > self._after)
+            docs = [doc for doc in docs if after(self._key(doc[0], doc[1]))]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        return [FakeSnapshot(self._collection.document(doc_id), data, update_time) for doc_id, data, update_time in docs]
+
+    async def stream(self):
+        client = self._collection.client
+        await client.latency.wait("firestore")
+        client.queries += 1
+        for snapshot in self._matching():
+            client.reads += 1
+            yield snapshot
+
+    def on_snapshot(self, callback):
+        """Deliver the current result set as ADDED changes, once, from a listener thread"""
+        client = self._collection.client
+
+        def deliver():
+            client.latency.block("firestore")
+            snapshots = self._matching()
+            client.reads += len(snapshots)
+            changes = [SimpleNamespace(type=SimpleNamespace(name="ADDED"), document=doc) for doc in snapshots]
+            callback(snapshots, changes, datetime.now(timezone.utc))
+
+        thread = threading.Thread(target=deliver, daemon=True)
+        thread.start()
+        return SimpleNamespace(unsubscribe=thread.join)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name: str):
+        super().__init__(self)
+        self.client = client
+        self.name = name
+        self.docs = {}
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, data: dict):
+        self._writes.append((reference, "create", data, False, None))
+
+    def set(self, reference, data: dict, merge: bool = False):
+        self._writes.append((reference, "set", data, merge, None))
+
+    def update(self, reference, data: dict, option=None):
+        self._writes.append((reference, "update", data, False, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append((reference, "delete", None, False, option))
+
+    async def commit(self):
+        await self._client.latency.wait("firestore")
+        # Check every precondition first so a failed batch changes nothing
+        for reference, kind, _, _, option in self._writes:
+            existing, update_time = reference._store.get(reference.id, (None, None))
+            if option is not None and option.last_update_time != update_time:
+                raise FailedPrecondition("update time precondition failed")
+            if kind == "create" and existing is not None:
+                raise AlreadyExists(f"Document already exists: {reference.id}")
+        self._client.writes += len(self._writes)
+        return [
+            SimpleNamespace(update_time=reference._apply(kind, data, merge))
+            for reference, kind, data, merge, _ in self._writes
+        ]
+
+
+class FakeFirestore:
+    """Dict-backed async Firestore client covering the calls main.py makes"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.collections = {}
+        self.reads = self.writes = self.queries = 0
+
+    def collection(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self, name)
+        return self.collections[name]
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def write_option(self, last_update_time=None):
+        return SimpleNamespace(last_update_time=last_update_time)
+
+    async def get_all(self, references):
+        await self.latency.wait("firestore")
+        for reference in references:
+            self.reads += 1
+            yield reference._snapshot()
+
+
+class FakeAuth:
+    """Replacements for the firebase_admin.auth functions main.py calls.
+
+    ID tokens are simply "token:<uid>", so benchmarks can mint them freely.
+    """
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.users = {}
+        self.calls = 0
+
+    def _user(self, uid: str):
+        return SimpleNamespace(uid=uid, email=self.users[uid])
+
+    def add_user(self, uid: str, email: str) -> None:
+        self.users[uid] = email
+
+    def verify_id_token(self, token: str, *args, **kwargs) -> dict:
+        self.calls += 1
+        self.latency.block("auth")
+        if not token.startswith("token:"):
+            raise auth.InvalidIdTokenError("Malformed fake token")
+        uid = token.split(":", 1)[1]
+        return {"uid": uid, "email": self.users.get(uid), "exp": time.time() + 3600}
+
+    def get_user(self, uid: str):
+        self.calls += 1
+        self.latency.block("auth")
+        if uid not in self.users:
+            raise auth.UserNotFoundError(f"No user {uid}")
+        return self._user(uid)
+
+    def get_user_by_email(self, email: str):
+        self.calls += 1
+        self.latency.block("auth")
+        for uid, user_email in self.users.items():
+            if user_email == email:
+                return self._user(uid)
+        raise auth.UserNotFoundError(f"No user {email}")
+
+    def create_user(self, email: str, password: str, **kwargs):
+        self.calls += 1
+        self.latency.block("auth")
+        if email in self.users.values():
+            raise auth.EmailAlreadyExistsError("Email already exists", None, None)
+        uid = uuid.uuid4().hex[:28]
+        self.users[uid] = email
+        return self._user(uid)
+
+    def generate_email_verification_link(self, email: str, action_code_settings=None, **kwargs) -> str:
+        self.calls += 1
+        self.latency.block("auth")
+        return f"https://example.invalid/verify?email={email}"
+
+    def create_custom_token(self, uid: str, *args, **kwargs) -> bytes:
+        self.calls += 1
+        return f"custom:{uid}".encode()
+
+
+def identity_toolkit_transport(fake_auth: FakeAuth, latency: Latency) -> httpx.MockTransport:
+    """Answers accounts:signInWithPassword and accounts:sendOobCode like Identity Toolkit"""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await latency.wait("identity_toolkit")
+        payload = json.loads(request.content or b"{}")
+        if request.url.path.endswith("accounts:signInWithPassword"):
+            for uid, email in fake_auth.users.items():
+                if email == payload.get("email"):
+                    return httpx.Response(200, json={"localId": uid, "email": email, "idToken": f"token:{uid}"})
+            return httpx.Response(400, json={"error": {"message": "EMAIL_NOT_FOUND"}})
+        if request.url.path.endswith("accounts:signInWithCustomToken"):
+            uid = payload.get("token", "").split(":", 1)[-1]
+            return httpx.Response(200, json={"localId": uid, "idToken": f"token:{uid}"})
+        if request.url.path.endswith("accounts:sendOobCode"):
+            return httpx.Response(200, json={"email": payload.get("email")})
+        return httpx.Response(404, json={"error": {"message": "NOT_FOUND"}})
+
+    return httpx.MockTransport(handler)
+
+
+@dataclass
+class FakeEnvironment:
+    latency: Latency
+    firestore: FakeFirestore
+    auth: FakeAuth
+
+
+def install(latency: Optional[Latency] = None) -> FakeEnvironment:
+    """Point firebase_admin at in-memory fakes; call before importing main"""
+    latency = latency or Latency()
+    store = FakeFirestore(latency)
+    fake_auth = FakeAuth(latency)
+
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-benchmark-secret-key")
+    os.environ.setdefault("FIREBASE_PRIVATE_KEY", "fake")
+    os.environ.setdefault("FIREBASE_API_KEY", "fake")
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: SimpleNamespace(name="[DEFAULT]")
+    firestore_async.client = lambda *args, **kwargs: store
+    firestore.client = lambda *args, **kwargs: store
+    for name in (
+        "verify_id_token",
+        "get_user",
+        "get_user_by_email",
+        "create_user",
+        "generate_email_verification_link",
+        "create_custom_token",
+    ):
+        setattr(auth, name, getattr(fake_auth, name))
+
+    return FakeEnvironment(latency=latency, firestore=store, auth=fake_auth)
@@ -0,0 +1,360 @@
+"""Offline load test for every endpoint in task/main.py.
+
+Firebase is replaced by the in-memory fakes in fakes.py, with injected
+latency per dependency. Requests are made in-process through
+httpx.ASGITransport, so no server or network is involved. Each route is
+driven for --requests calls at --concurrency, one route at a time. The
+report gives throughput and p50/p95/p99 latency per route as JSON, and
+--compare prints the change against an earlier report. The exit status is
+1 when any route answered 5xx or raised, so a broken route cannot pass
+unnoticed:
+
+    python benchmarks/loadtest.py --output before.json
+    git checkout <other commit>
+    python benchmarks/loadtest.py --compare before.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "task"))
+import fakes  # noqa: E402
+
+PASSWORD = "Bench-pass-1!"
+BULK_DELETE_ITEMS = 5
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def seed(
+    env: fakes.FakeEnvironment, main, users: int, subscriptions: int, deletable: int, prefix: str = "bench-user"
+) -> dict:
+    """Populate the fakes directly (not through the API) and return per-user fixtures"""
+    subs = env.firestore.collection("subscriptions")
+    now = datetime.now()
+    fixtures = {}
+    for index in range(users):
+        uid = f"{prefix}-{index}"
+        email = f"{uid}@example.com"
+        env.auth.add_user(uid, email)
+        env.firestore.collection("users").document(uid)._apply("set", {"uid": uid, "email": email})
+        ids = []
+        for number in range(subscriptions + deletable):
+            doc = subs.document()
+            doc._apply("set", {
+                "service_name": f"Service {number}",
+                "cost": 5.0 + number,
+                "billing_cycle": "Yearly" if number % 3 == 0 else "Monthly",
+                "next_renewal_date": "2030-01-01",
+                "renewal_at": datetime(2030, 1, 1, tzinfo=timezone.utc),
+                "status": "Active" if number % 4 else "Cancelled",
+                "user_id": uid,
+                "created_at": now,
+                "updated_at": now,
+            })
+            ids.append(doc.id)
+        fixtures[uid] = {
+            "email": email,
+            "ids": ids[:subscriptions],
+            "cursors": [main.encode_cursor(sub_id) for sub_id in sorted(ids)],
+            "deletable": iter(ids[subscriptions:]),
+            "refresh": main.create_refresh_token({"sub": uid}),
+            "access": main.create_access_token({"sub": uid, "email": email, "scope": "user"}),
+        }
+    return fixtures
+
+
+def subscription_body(uid: str, number: int) -> dict:
+    return {
+        "service_name": f"Bench {number}",
+        "cost": 9.99,
+        "billing_cycle": "Monthly",
+        "next_renewal_date": "2030-06-01",
+        "status": "Active",
+        "user_id": uid,
+    }
+
+
+def scenarios(fixtures: dict, cold: dict):
+    """(route name, request builder) pairs; a builder returns httpx.request kwargs.
+
+    `cold` users are only used by the uncached scenarios, so their lists are
+    never loaded into the subscription cache and every page goes to Firestore.
+    """
+    users = itertools.cycle(list(fixtures))
+    cold_users = itertools.cycle(list(cold))
+    counter = itertools.count()
+
+    def bearer(uid):
+        return {"Authorization": f"Bearer token:{uid}"}
+
+    def pick(uid):
+        ids = fixtures[uid]["ids"]
+        return ids[next(counter) % len(ids)]
+
+    def build(fn, pool=users):
+        def builder():
+            return fn(next(pool))
+        return builder
+
+    return [
+        ("GET /", build(lambda uid: dict(method="GET", url="/"))),
+        ("POST /auth/login", build(lambda uid: dict(
+            method="POST", url="/auth/login",
+            json={"email": fixtures[uid]["email"], "password": PASSWORD}))),
+        ("POST /auth/refresh", build(lambda uid: dict(
+            method="POST", url="/auth/refresh", cookies={"refresh_token": fixtures[uid]["refresh"]}))),
+        ("POST /auth/google", build(lambda uid: dict(
+            method="POST", url="/auth/google", json={"token": f"token:{uid}"}))),
+        ("POST /auth/register", build(lambda uid: dict(
+            method="POST", url="/auth/register",
+            json={"email": f"new-{next(counter)}@example.com", "password": PASSWORD}))),
+        ("POST /auth/forgot-password", build(lambda uid: dict(
+            method="POST", url="/auth/forgot-password", json={"email": fixtures[uid]["email"]}))),
+        ("GET /auth/me", build(lambda uid: dict(
+            method="GET", url="/auth/me", cookies={"token": fixtures[uid]["access"]}))),
+        ("POST /auth/send-verification-email", build(lambda uid: dict(
+            method="POST", url="/auth/send-verification-email", cookies={"token": fixtures[uid]["access"]}))),
+        ("POST /auth/logout", build(lambda uid: dict(method="POST", url="/auth/logout"))),
+        ("GET /api/subscriptions", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions", headers=bearer(uid)))),
+        ("GET /api/subscriptions?limit", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions", params={"limit": 10}, headers=bearer(uid)))),
+        ("GET /api/subscriptions?filtered", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions",
+            params={"status": "Active", "sort": "-cost", "fields": "service_name,cost", "limit": 10},
+            headers=bearer(uid)))),
+        ("GET /api/subscriptions?stream", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions", params={"stream": "true"}, headers=bearer(uid)))),
+        ("GET /api/subscriptions?limit&cursor (uncached)", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions",
+            params={"limit": 5, "cursor": cold[uid]["cursors"][next(counter) % len(cold[uid]["cursors"])]},
+            headers=bearer(uid)), cold_users)),
+        ("GET /api/subscriptions?stream (uncached)", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions", params={"stream": "true", "limit": 10},
+            headers=bearer(uid)), cold_users)),
+        ("GET /api/subscriptions/renewals", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions/renewals",
+            params={"start": "2029-12-01", "end": "2030-01-31"}, headers=bearer(uid)))),
+        ("GET /api/subscriptions/analytics", build(lambda uid: dict(
+            method="GET", url="/api/subscriptions/analytics", headers=bearer(uid)))),
+        ("GET /api/subscriptions/{id}", build(lambda uid: dict(
+            method="GET", url=f"/api/subscriptions/{pick(uid)}", headers=bearer(uid)))),
+        ("POST /api/subscriptions", build(lambda uid: dict(
+            method="POST", url="/api/subscriptions", json=subscription_body(uid, next(counter)),
+            headers=bearer(uid)))),
+        ("PUT /api/subscriptions/{id}", build(lambda uid: dict(
+            method="PUT", url=f"/api/subscriptions/{pick(uid)}", json=subscription_body(uid, next(counter)),
+            headers=bearer(uid)))),
+        ("DELETE /api/subscriptions/{id}", build(lambda uid: dict(
+            method="DELETE", url=f"/api/subscriptions/{next(fixtures[uid]['deletable'])}",
+            headers=bearer(uid)))),
+        ("POST /api/subscriptions/bulk", build(lambda uid: dict(
+            method="POST", url="/api/subscriptions/bulk",
+            json=[subscription_body(uid, next(counter)) for _ in range(20)], headers=bearer(uid)))),
+        ("PUT /api/subscriptions/bulk", build(lambda uid: dict(
+            method="PUT", url="/api/subscriptions/bulk",
+            json=[{**subscription_body(uid, next(counter)), "subscription_id": sub_id}
+                  for sub_id in fixtures[uid]["ids"][:20]],
+            headers=bearer(uid)))),
+        ("POST /api/subscriptions/bulk-delete", build(lambda uid: dict(
+            method="POST", url="/api/subscriptions/bulk-delete",
+            json={"subscription_ids": [next(fixtures[uid]["deletable"]) for _ in range(BULK_DELETE_ITEMS)]},
+            headers=bearer(uid)))),
+        ("GET /api/subscriptions/total/{uid}", build(lambda uid: dict(
+            method="GET", url=f"/api/subscriptions/total/{uid}", headers=bearer(uid)))),
+        ("GET /api/subscriptions/changes (first event)", build(lambda uid: dict(
+            sse=True, url="/api/subscriptions/changes", headers=bearer(uid)))),
+        ("GET /metrics", build(lambda uid: dict(method="GET", url="/metrics"))),
+    ]
+
+
+async def first_event(app, url: str, headers: dict) -> int:
+    """Open a Server-Sent Events stream over raw ASGI, wait for its first event, then disconnect.
+
+    httpx.ASGITransport buffers the whole response body, which never ends
+    for an event stream. Returns the response status code.
+    """
+    status_code, done, requested = 500, asyncio.Event(), False
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": url,
+        "raw_path": url.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")] + [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif b"event: " in message.get("body", b"") or not message.get("more_body", False):
+            done.set()
+
+    await asyncio.wait_for(app(scope, receive, send), timeout=30)
+    return status_code
+
+
+async def drive(client: httpx.AsyncClient, app, builder, requests: int, concurrency: int) -> dict:
+    latencies, errors, statuses = [], 0, {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            kwargs = builder()
+            start = time.perf_counter()
+            try:
+                if kwargs.pop("sse", False):
+                    code = await first_event(app, **kwargs)
+                else:
+                    response = await client.request(**kwargs)
+                    code = response.status_code
+            except Exception:
+                code = "exception"
+            latencies.append(time.perf_counter() - start)
+            statuses[str(code)] = statuses.get(str(code), 0) + 1
+            if code == "exception" or code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "statuses": statuses,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    latency = fakes.Latency(
+        firestore=args.firestore_ms / 1000,
+        auth=args.auth_ms / 1000,
+        identity_toolkit=args.identity_toolkit_ms / 1000,
+        jitter=args.jitter,
+    )
+    env = fakes.install(latency)
+    import main
+
+    # The benchmark measures handler cost, not the auth rate limits
+    for scope in main.RATE_LIMITS:
+        main.RATE_LIMITS[scope] = "1000000000/second"
+    main.parse_rate.cache_clear()
+
+    # DELETE /{id} and bulk-delete both draw from each user's deletable ids
+    deletable = (args.requests // args.users + 1) * (1 + BULK_DELETE_ITEMS)
+    fixtures = seed(env, main, args.users, args.subscriptions, deletable=deletable)
+    cold = seed(env, main, args.users, args.subscriptions, deletable=0, prefix="cold-user")
+    report = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "routes": {},
+    }
+
+    async with main.lifespan(main.app):
+        await main.app.state.http_client.aclose()
+        main.app.state.http_client = httpx.AsyncClient(
+            base_url=main.IDENTITY_TOOLKIT_URL,
+            transport=fakes.identity_toolkit_transport(env.auth, latency),
+        )
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, builder in scenarios(fixtures, cold):
+                if args.route and not any(fragment in name for fragment in args.route):
+                    continue
+                report["routes"][name] = await drive(client, main.app, builder, args.requests, args.concurrency)
+                print(f"{name:<40} {report['routes'][name]}", file=sys.stderr)
+    return report
+
+
+def compare(report: dict, baseline: dict) -> None:
+    print(f"{'route':<40} {'rps':>18} {'p50 ms':>18} {'p99 ms':>18}")
+    for name, result in report["routes"].items():
+        before = baseline["routes"].get(name)
+        if not before:
+            continue
+        cells = [
+            f"{before[key]:>8} -> {result[key]:<8}"
+            for key in ("throughput_rps", "p50_ms", "p99_ms")
+        ]
+        print(f"{name:<40} {' '.join(cells)}")
+
+
+def failing_routes(report: dict) -> list:
+    """Routes with any 5xx response or exception; 4xx can be expected (404s, 409s)"""
+    return [
+        name for name, result in report["routes"].items()
+        if any(code == "exception" or code.startswith("5") for code in result["statuses"])
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--subscriptions", type=int, default=20, help="seeded subscriptions per user")
+    parser.add_argument("--firestore-ms", type=float, default=5.0)
+    parser.add_argument("--auth-ms", type=float, default=2.0)
+    parser.add_argument("--identity-toolkit-ms", type=float, default=30.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- fraction applied to each latency")
+    parser.add_argument("--route", action="append", help="only run routes containing this text")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    broken = failing_routes(report)
+    if broken:
+        print(f"Routes answering 5xx or raising: {', '.join(broken)}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,70 @@
+"""Cold-start profile of task/main.py, phase by phase.
+
+Run it in a fresh interpreter with the app's real environment (.env with
+the Firebase service account). Each phase is timed in the order a cold
+instance goes through them:
+
+    import:dependencies     fastapi, firebase_admin, google.cloud.firestore / gRPC
+    import:main             the module body itself (clients are lazy now)
+    firebase:credentials    building the service-account Certificate
+    firebase:initialize_app
+    firebase:firestore_client
+    warmup:firestore        first round trip: gRPC channel + access token
+    warmup:token_certs      fetching the ID token signing certs
+
+    python benchmarks/profile_startup.py [--json]
+
+For a per-module breakdown of the import phases, use
+`python -X importtime -c "import main"` from task/.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "task"))
+
+DEPENDENCIES = [
+    "fastapi",
+    "httpx",
+    "firebase_admin",
+    "firebase_admin.auth",
+    "google.cloud.firestore",
+    "firebase_admin.firestore_async",
+]
+
+
+def timed(phases: list, name: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    phases.append((name, time.perf_counter() - start))
+    return result
+
+
+def main(as_json: bool) -> None:
+    phases = []
+    timed(phases, "import:dependencies", lambda: [importlib.import_module(name) for name in DEPENDENCIES])
+    app_module = timed(phases, "import:main", lambda: importlib.import_module("main"))
+    cred = timed(phases, "firebase:credentials", app_module.firebase_credentials)
+    # Reuse the parsed credentials so this phase is initialize_app alone
+    timed(phases, "firebase:initialize_app", lambda: app_module.get_firebase_app(cred))
+    timed(phases, "firebase:firestore_client", app_module.get_db)
+    timed(phases, "warmup:firestore", lambda: asyncio.run(app_module.warm_up_firestore()))
+    timed(phases, "warmup:token_certs", lambda: asyncio.run(app_module.warm_up_token_certs()))
+
+    if as_json:
+        print(json.dumps({name: round(seconds * 1000, 2) for name, seconds in phases}, indent=2))
+        return
+    total = sum(seconds for _, seconds in phases)
+    for name, seconds in phases:
+        print(f"{name:<28} {seconds * 1000:9.1f} ms  {seconds / total:6.1%}")
+    print(f"{'total':<28} {total * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print phase timings in ms as JSON")
+    main(parser.parse_args().json)
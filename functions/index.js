@@ -1,4 +1,5 @@
 const { onSchedule } = require("firebase-functions/v2/scheduler");
+const { onDocumentCreated, onDocumentWritten } = require("firebase-functions/v2/firestore");
 const { logger } = require("firebase-functions/v2");
 const admin = require("firebase-admin");
 const nodemailer = require("nodemailer");
@@ -15,158 +16,311 @@ const transporter = nodemailer.createTransport({
     },
 });
 
-exports.dailySubscriptionRenewal = onSchedule(
+// Per-user subscription totals (monthly total plus counts by billing cycle
+// and status). The API applies its own writes' deltas in the same commit;
+// this trigger covers every other writer, such as the dashboard's direct
+// Firestore writes. `python main.py rebuild-totals` recomputes them from
+// scratch if they ever drift.
+const BILLING_CYCLES = ["Monthly", "Yearly"];
+const STATUSES = ["Active", "Cancelled"];
+// One marker per write in subscription_totals_events, claimed by whichever of
+// the API and this trigger applies the write first, so neither an API write
+// nor a redelivered event is counted twice; expired by the TTL policy on
+// `expire_at` (firestore.indexes.json)
+const TOTALS_EVENT_TTL_DAYS = 7;
+
+// Same id as totals_event_id() in main.py: the subscription plus the update
+// time of the version the write replaced
+function totalsEventId(subscriptionId, before) {
+    if (!before.exists) {
+        return `${subscriptionId}@created`;
+    }
+    const { seconds, nanoseconds } = before.updateTime;
+    return `${subscriptionId}@${seconds}.${String(nanoseconds).padStart(9, "0")}`;
+}
+
+function monthlyCost(sub) {
+    if (sub.status !== "Active") {
+        return 0;
+    }
+    return (Number(sub.cost) || 0) / (sub.billing_cycle === "Yearly" ? 12 : 1);
+}
+
+function addToTotals(totals, sub, sign) {
+    const userId = sub.user_id;
+    if (!userId) {
+        return;
+    }
+    const entry = totals.get(userId) || { monthly_total: 0, count_by_cycle: {}, count_by_status: {} };
+    entry.monthly_total += sign * monthlyCost(sub);
+    if (BILLING_CYCLES.includes(sub.billing_cycle)) {
+        entry.count_by_cycle[sub.billing_cycle] = (entry.count_by_cycle[sub.billing_cycle] || 0) + sign;
+    }
+    if (STATUSES.includes(sub.status)) {
+        entry.count_by_status[sub.status] = (entry.count_by_status[sub.status] || 0) + sign;
+    }
+    totals.set(userId, entry);
+}
+
+function incrementsFor(counts) {
+    // Zero entries are left out so the merge does not touch those counts
+    const increments = {};
+    for (const [key, value] of Object.entries(counts)) {
+        if (value) {
+            increments[key] = admin.firestore.FieldValue.increment(value);
+        }
+    }
+    return increments;
+}
+
+exports.maintainSubscriptionTotals = onDocumentWritten(
     {
-        schedule: "0 0 * * *", // Midnight daily
-        timeZone: "Asia/Kuala_Lumpur",
-        region: "asia-southeast1"  
+        document: "subscriptions/{subscriptionId}",
+        region: "asia-southeast1"
     },
     async (event) => {
-        try {
-            const now = new Date();
-            now.setHours(now.getHours() + 8);
-            now.setHours(0, 0, 0, 0);
-            const nowString = now.toISOString().split('T')[0];
-
-            logger.log(`Running renewal check for dates before ${nowString}`);
-
-            const activeSubs = await admin.firestore()
-                .collection("subscriptions")
-                .where("status", "==", "Active")
-                .get();
-
-            const batch = admin.firestore().batch();
-            let updateCount = 0;
-
-            activeSubs.forEach((doc) => {
-                const sub = doc.data();
-                const renewalDateStr = sub.next_renewal_date;
-                
-                if (renewalDateStr < nowString) {
-                    const renewalDate = new Date(renewalDateStr);
-                    renewalDate.setHours(0, 0, 0, 0);
-                    
-                    let nextRenewal = new Date(renewalDate);
-                    const originalDate = renewalDate.getDate();
-                    nextRenewal.setMonth(nextRenewal.getMonth() + 1);
-                
-                    if (nextRenewal.getDate() !== originalDate) {
-                        nextRenewal = new Date(nextRenewal.getFullYear(), nextRenewal.getMonth() + 1, 0);
-                    }
-                    
-                    const nextRenewalStr = nextRenewal.toISOString().split('T')[0];
-
-                    batch.update(doc.ref, {
-                        next_renewal_date: nextRenewalStr,
-                        updated_at: admin.firestore.FieldValue.serverTimestamp(),
-                    });
-                    updateCount++;
-                }
-            });
+        const before = event.data.before.exists ? event.data.before.data() : null;
+        const after = event.data.after.exists ? event.data.after.data() : null;
 
-            if (updateCount > 0) {
-                await batch.commit();
-                logger.log(`Updated ${updateCount} subscriptions`);
-            } else {
-                logger.log("No subscriptions required renewal");
+        const totals = new Map();
+        if (before) {
+            addToTotals(totals, before, -1);
+        }
+        if (after) {
+            addToTotals(totals, after, 1);
+        }
+        if (totals.size === 0) {
+            return;
+        }
+
+        const db = admin.firestore();
+        const batch = db.batch();
+        const expireAt = new Date(Date.now() + TOTALS_EVENT_TTL_DAYS * 24 * 60 * 60 * 1000);
+        const eventId = totalsEventId(event.params.subscriptionId, event.data.before);
+        batch.create(db.collection("subscription_totals_events").doc(eventId), { expire_at: expireAt });
+        for (const [userId, entry] of totals) {
+            const delta = {
+                user_id: userId,
+                monthly_total: admin.firestore.FieldValue.increment(entry.monthly_total),
+                // Also the version behind the list ETag, so every writer bumps it
+                updated_at: admin.firestore.FieldValue.serverTimestamp(),
+            };
+            const cycles = incrementsFor(entry.count_by_cycle);
+            const statuses = incrementsFor(entry.count_by_status);
+            if (Object.keys(cycles).length) {
+                delta.count_by_cycle = cycles;
+            }
+            if (Object.keys(statuses).length) {
+                delta.count_by_status = statuses;
             }
+            batch.set(db.collection("subscription_totals").doc(userId), delta, { merge: true });
+        }
+
+        try {
+            await batch.commit();
         } catch (error) {
-            logger.error("Renewal error:", error);
+            // ALREADY_EXISTS on the marker: the API's commit or an earlier delivery applied this write
+            if (error.code === 6) {
+                logger.log(`Totals for write ${eventId} already applied`);
+                return;
+            }
             throw error;
         }
     }
 );
 
-exports.sendRenewalReminders = onSchedule(
-    { 
-        schedule: "0 0 * * *", // Midnight daily
+// Renewals are rolled forward (by billing cycle) and reminders queued by
+// processRenewals below, every hour on Cloud Scheduler. It keeps the same
+// contract as the API's RenewalScheduler (RENEWAL_SCHEDULER=true, which only
+// adds on-time rolls between runs): reminders have deterministic ids and
+// rolls are preconditioned on the update time, so running both repeats no
+// work. Both read `renewal_at`, which syncRenewalAt keeps in step with
+// `next_renewal_date` for writers that only set the date string, such as
+// the dashboard.
+const RENEWAL_REMINDER_DAYS = Number(process.env.RENEWAL_REMINDER_DAYS || 3);
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+function renewalDay(nextRenewalDate) {
+    // Same rule as renewal_date() in main.py: YYYY-MM-DD, optionally followed by a time
+    const match = /^(\d{4})-(\d{2})-(\d{2})(T|$)/.exec(String(nextRenewalDate ?? ""));
+    if (!match) {
+        return null;
+    }
+    const [year, month, day] = [Number(match[1]), Number(match[2]), Number(match[3])];
+    const midnight = new Date(Date.UTC(year, month - 1, day));
+    if (midnight.getUTCMonth() !== month - 1 || midnight.getUTCDate() !== day) {
+        return null;
+    }
+    return midnight;
+}
+
+function renewalAt(nextRenewalDate) {
+    const day = renewalDay(nextRenewalDate);
+    return day === null ? null : admin.firestore.Timestamp.fromDate(day);
+}
+
+// Same rules as add_months() and roll_renewal_date() in main.py
+function addMonths(day, months) {
+    const shifted = new Date(Date.UTC(day.getUTCFullYear(), day.getUTCMonth() + months, 1));
+    const monthEnd = new Date(Date.UTC(shifted.getUTCFullYear(), shifted.getUTCMonth() + 1, 0)).getUTCDate();
+    shifted.setUTCDate(Math.min(day.getUTCDate(), monthEnd));
+    return shifted;
+}
+
+function rollRenewalDate(day, billingCycle, today) {
+    const step = billingCycle === "Yearly" ? 12 : 1;
+    let months = 0;
+    while (addMonths(day, months) <= today) {
+        months += step;
+    }
+    return addMonths(day, months);
+}
+
+async function queueReminder(db, doc) {
+    const sub = doc.data();
+    const renewsOn = sub.renewal_at.toDate().toISOString().split('T')[0];
+    try {
+        await db.collection("renewal_reminders").doc(`${doc.id}_${renewsOn}`).create({
+            user_id: sub.user_id,
+            subscription_id: doc.id,
+            service_name: sub.service_name,
+            cost: sub.cost,
+            renewal_at: sub.renewal_at,
+            status: "pending",
+            created_at: admin.firestore.FieldValue.serverTimestamp(),
+        });
+        return true;
+    } catch (error) {
+        if (error.code === 6) {
+            return false;  // ALREADY_EXISTS: queued by an earlier run or the API
+        }
+        throw error;
+    }
+}
+
+async function rollRenewal(db, doc, now) {
+    const sub = doc.data();
+    const day = renewalDay(sub.next_renewal_date);
+    if (day === null) {
+        return false;
+    }
+    const today = new Date(Date.UTC(now.getUTCFullYear(), now.getUTCMonth(), now.getUTCDate()));
+    const next = rollRenewalDate(day, sub.billing_cycle, today);
+    const batch = db.batch();
+    batch.update(doc.ref, {
+        next_renewal_date: next.toISOString().split('T')[0],
+        renewal_at: admin.firestore.Timestamp.fromDate(next),
+        updated_at: admin.firestore.FieldValue.serverTimestamp(),
+    }, { lastUpdateTime: doc.updateTime });
+    // Bump the owner's collection version so conditional list reads see the change
+    batch.set(db.collection("subscription_totals").doc(sub.user_id), {
+        updated_at: admin.firestore.FieldValue.serverTimestamp(),
+    }, { merge: true });
+    try {
+        await batch.commit();
+        return true;
+    } catch (error) {
+        if (error.code === 9 || error.code === 5) {
+            return false;  // FAILED_PRECONDITION / NOT_FOUND: changed since the query, next run sees it
+        }
+        throw error;
+    }
+}
+
+exports.processRenewals = onSchedule(
+    {
+        schedule: "every 60 minutes",
         timeZone: "Asia/Kuala_Lumpur",
-        region: "asia-southeast1"  
+        region: "asia-southeast1"
     },
-    async (event) => {
-        try {
-            const today = new Date();
-            today.setHours(today.getHours() + 8);
-            today.setHours(0, 0, 0, 0);
-            const tomorrow = new Date(today);
-            tomorrow.setDate(tomorrow.getDate() + 1);
-            const tomorrowStr = tomorrow.toISOString().split('T')[0];
-
-            logger.log(`Checking subscriptions renewing by ${tomorrowStr}`);
-
-            const expiringSubs = await admin.firestore()
-                .collection("subscriptions")
-                .where("status", "==", "Active")
-                .where("next_renewal_date", "==", tomorrowStr)
-                .get();
-
-            const userSubscriptions = new Map();
-
-            for (const doc of expiringSubs.docs) {
-                const sub = doc.data();
-                const userId = sub.user_id;
-
-                if (!userId) {
-                    logger.warn(`Skipping subscription ${doc.id} - no user_id`);
-                    continue;
-                }
+    async () => {
+        const db = admin.firestore();
+        const now = new Date();
+        const horizon = new Date(now.getTime() + RENEWAL_REMINDER_DAYS * DAY_MS);
+        // Served by the (status, renewal_at) index; the range skips the null renewal_at of undated subscriptions
+        const due = await db.collection("subscriptions")
+            .where("status", "==", "Active")
+            .where("renewal_at", "<=", admin.firestore.Timestamp.fromDate(horizon))
+            .orderBy("renewal_at")
+            .get();
 
-                try {
-                    const user = await admin.auth().getUser(userId);
-                    const userEmail = user.email;
-
-                    if (!userEmail) {
-                        logger.warn(`Skipping user ${userId} - no email`);
-                        continue;
-                    }
-
-                    if (!userSubscriptions.has(userEmail)) {
-                        userSubscriptions.set(userEmail, []);
-                    }
-                    userSubscriptions.get(userEmail).push(sub);
-                } catch (error) {
-                    logger.error(`Failed to fetch user ${userId}: `, error);
+        let rolled = 0;
+        let reminded = 0;
+        for (const doc of due.docs) {
+            try {
+                if (doc.data().renewal_at.toDate() <= now) {
+                    rolled += await rollRenewal(db, doc, now) ? 1 : 0;
+                } else {
+                    reminded += await queueReminder(db, doc) ? 1 : 0;
                 }
+            } catch (error) {
+                logger.error(`Renewal processing for ${doc.id} failed:`, error);
             }
+        }
+        logger.log(`Rolled ${rolled} renewal(s), queued ${reminded} reminder(s)`);
+    }
+);
 
-            const emailPromises = Array.from(userSubscriptions.entries()).map(
-                async ([userEmail, subscriptions]) => {
-                    try {
-                        const subscriptionsList = subscriptions
-                        .map(
-                            (sub) => `
-                            <li>
-                            <strong>${sub.service_name || "Unnamed Subscription"}</strong>
-                            (Renews on ${sub.next_renewal_date}, Amount: RM${sub.cost || "N/A"})
-                            </li>
-                        `
-                        )
-                        .join("");
-            
-                        await transporter.sendMail({
-                        from: process.env.GMAIL_EMAIL,
-                        to: userEmail,
-                        subject: `Renewal Reminders for ${subscriptions.length} Subscription(s)`,
-                        html: `
-                            <h3>Upcoming Subscription Renewals</h3>
-                            <p>You have ${subscriptions.length} subscription(s) renewing soon:</p>
-                            <ul>${subscriptionsList}</ul>
-                            <p>Total: RM${subscriptions.reduce((sum, sub) => sum + (sub.cost || 0), 0)}</p>
-                        `,
-                        });
-                        logger.log(`Sent combined reminder to ${userEmail}`);
-                    } catch (error) {
-                        logger.error(`Failed to email ${userEmail}:`, error);
-                    }
-                }
-            );        
+exports.syncRenewalAt = onDocumentWritten(
+    {
+        document: "subscriptions/{subscriptionId}",
+        region: "asia-southeast1"
+    },
+    async (event) => {
+        if (!event.data.after.exists) {
+            return;
+        }
+        const sub = event.data.after.data();
+        const expected = renewalAt(sub.next_renewal_date);
+        const current = sub.renewal_at;
+        // Null rather than absent without a valid date: queries ordered by
+        // renewal_at leave out documents that lack the field entirely
+        if (current !== undefined && (expected === null ? current === null : current !== null && current.isEqual(expected))) {
+            return;  // Already in step, including after this function's own write
+        }
+        await event.data.after.ref.update({ renewal_at: expected });
+    }
+);
 
-            await Promise.all(emailPromises);
-            logger.log(`Sent ${expiringSubs.size} reminders`);
-        
+// Delivers the reminders processRenewals (or RenewalScheduler) creates in `renewal_reminders`
+// (one per subscription and renewal date, so a retried scheduler cannot
+// email twice), and records the outcome on the reminder.
+exports.sendRenewalReminder = onDocumentCreated(
+    {
+        document: "renewal_reminders/{reminderId}",
+        region: "asia-southeast1"
+    },
+    async (event) => {
+        const reminder = event.data.data();
+        if (reminder.status !== "pending") {
+            return;
+        }
+        const renewsOn = reminder.renewal_at.toDate().toISOString().split('T')[0];
+        try {
+            const user = await admin.auth().getUser(reminder.user_id);
+            if (!user.email) {
+                logger.warn(`Skipping reminder ${event.params.reminderId} - user ${reminder.user_id} has no email`);
+                await event.data.ref.update({ status: "skipped" });
+                return;
+            }
+            await transporter.sendMail({
+                from: process.env.GMAIL_EMAIL,
+                to: user.email,
+                subject: `Renewal reminder: ${reminder.service_name || "Unnamed Subscription"}`,
+                html: `
+                    <h3>Upcoming Subscription Renewal</h3>
+                    <p><strong>${reminder.service_name || "Unnamed Subscription"}</strong>
+                    renews on ${renewsOn} (Amount: RM${reminder.cost ?? "N/A"}).</p>
+                `,
+            });
+            await event.data.ref.update({
+                status: "sent",
+                sent_at: admin.firestore.FieldValue.serverTimestamp(),
+            });
+            logger.log(`Sent reminder ${event.params.reminderId} to ${user.email}`);
         } catch (error) {
-            logger.error("Reminder error:", error);
-            throw error;
+            logger.error(`Failed to send reminder ${event.params.reminderId}:`, error);
+            await event.data.ref.update({ status: "failed", last_error: String(error) });
         }
     }
 );
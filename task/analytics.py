@@ -0,0 +1,217 @@
+"""Vectorized spending analytics over subscriptions held as columns.
+
+`Columns.from_subscriptions` turns subscription dicts (as stored in
+Firestore) into NumPy arrays once; every breakdown and projection after that
+is array arithmetic. `user_summary` serves the per-user endpoint and
+`FleetAggregate` folds the whole collection chunk by chunk, holding only
+running sums, so the batch job's memory does not grow with the collection.
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+CYCLES = ("Monthly", "Yearly")
+CYCLE_MONTHS = np.array([1, 12])
+STATUSES = ("Active", "Cancelled")
+PROJECTION_MONTHS = 12
+# Upper bounds (monthly spend per user) of the fleet histogram buckets
+SPEND_BUCKETS = np.array([0.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, np.inf])
+
+
+def _renewal_day(sub: dict) -> Optional[str]:
+    renewal_at = sub.get("renewal_at")
+    if renewal_at is not None:
+        return renewal_at.date().isoformat()
+    try:
+        return date.fromisoformat(str(sub.get("next_renewal_date", "")).partition("T")[0]).isoformat()
+    except ValueError:
+        return None
+
+
+@dataclass
+class Columns:
+    user: np.ndarray     # object, owner uid
+    service: np.ndarray  # object, service name
+    cost: np.ndarray     # float64, cost per billing cycle
+    cycle: np.ndarray    # int8, index into CYCLES
+    status: np.ndarray   # int8, index into STATUSES
+    renewal: np.ndarray  # datetime64[D], NaT when the stored date is unusable
+
+    @classmethod
+    def from_subscriptions(cls, subs: Iterable[dict]) -> "Columns":
+        subs = list(subs)
+        count = len(subs)
+        return cls(
+            user=np.array([sub["user_id"] for sub in subs], dtype=object),
+            service=np.array([sub["service_name"].strip() for sub in subs], dtype=object),
+            cost=np.fromiter((sub["cost"] for sub in subs), dtype=np.float64, count=count),
+            cycle=np.fromiter((CYCLES.index(sub["billing_cycle"]) for sub in subs), dtype=np.int8, count=count),
+            status=np.fromiter((STATUSES.index(sub["status"]) for sub in subs), dtype=np.int8, count=count),
+            renewal=np.array([_renewal_day(sub) for sub in subs], dtype="datetime64[D]"),
+        )
+
+    def __len__(self) -> int:
+        return len(self.cost)
+
+    @property
+    def active(self) -> np.ndarray:
+        return self.status == STATUSES.index("Active")
+
+    def monthly_cost(self) -> np.ndarray:
+        """Monthly-equivalent cost per subscription, zero unless active"""
+        return np.where(self.active, self.cost / CYCLE_MONTHS[self.cycle], 0.0)
+
+    def projection(self, today: date, months: int = PROJECTION_MONTHS) -> np.ndarray:
+        """Charges falling in each of the next `months` calendar months, this one first.
+
+        Monthly subscriptions charge every month from their next renewal,
+        yearly ones in the renewal month only. Past renewals are assumed to
+        have rolled forward; an unknown date charges from this month.
+        """
+        start = np.datetime64(today, "M")
+        first = (self.renewal.astype("datetime64[M]") - start).astype(np.int64)
+        first = np.where(np.isnat(self.renewal), 0, first)[:, None]
+        offsets = np.arange(months)[None, :]
+        period = CYCLE_MONTHS[self.cycle][:, None]
+        # Months from the first renewal on that land on the cycle; a past first renewal rolls forward
+        charged = ((offsets - first) % period == 0) & (offsets >= first)
+        return (charged * np.where(self.active, self.cost, 0.0)[:, None]).sum(axis=0)
+
+
+def _month_labels(today: date, months: int) -> List[str]:
+    start = np.datetime64(today, "M")
+    return [str(start + offset) for offset in range(months)]
+
+
+def _by_cycle(columns: Columns, monthly: np.ndarray) -> Dict[str, dict]:
+    counts = np.bincount(columns.cycle, minlength=len(CYCLES))
+    sums = np.bincount(columns.cycle, weights=monthly, minlength=len(CYCLES))
+    return {
+        cycle: {"count": int(counts[index]), "monthly_cost": round(float(sums[index]), 2)}
+        for index, cycle in enumerate(CYCLES)
+    }
+
+
+def _by_status(columns: Columns) -> Dict[str, int]:
+    counts = np.bincount(columns.status, minlength=len(STATUSES))
+    return {status: int(counts[index]) for index, status in enumerate(STATUSES)}
+
+
+def user_summary(subs: Iterable[dict], today: date) -> dict:
+    """Breakdowns by service, cycle and status plus a 12-month spend projection"""
+    columns = Columns.from_subscriptions(subs)
+    monthly = columns.monthly_cost()
+    projection = columns.projection(today)
+
+    services, inverse = np.unique(columns.service.astype(str), return_inverse=True)
+    service_costs = np.bincount(inverse, weights=monthly, minlength=len(services))
+    service_counts = np.bincount(inverse, minlength=len(services))
+    order = np.argsort(-service_costs, kind="stable")
+
+    return {
+        "monthly_total": round(float(monthly.sum()), 2),
+        "by_service": [
+            {
+                "service_name": str(services[index]),
+                "count": int(service_counts[index]),
+                "monthly_cost": round(float(service_costs[index]), 2),
+            }
+            for index in order
+        ],
+        "by_cycle": _by_cycle(columns, monthly),
+        "by_status": _by_status(columns),
+        "projection": [
+            {"month": month, "amount": round(float(amount), 2)}
+            for month, amount in zip(_month_labels(today, PROJECTION_MONTHS), projection)
+        ],
+        "projected_12_month_total": round(float(projection.sum()), 2),
+    }
+
+
+class FleetAggregate:
+    """Running fleet-wide sums, fed one chunk of columns at a time.
+
+    Chunks must arrive ordered by user_id so per-user spend can be closed off
+    as each user ends; only the user straddling a chunk boundary is carried
+    over. Memory is bounded by the chunk size plus the distinct service names.
+    """
+
+    def __init__(self, today: date):
+        self.today = today
+        self.subscriptions = 0
+        self.users = 0
+        self.monthly_total = 0.0
+        self.cycle_counts = np.zeros(len(CYCLES), dtype=np.int64)
+        self.cycle_costs = np.zeros(len(CYCLES))
+        self.status_counts = np.zeros(len(STATUSES), dtype=np.int64)
+        self.projection = np.zeros(PROJECTION_MONTHS)
+        self.spend_histogram = np.zeros(len(SPEND_BUCKETS), dtype=np.int64)
+        self.services = {}
+        self._carry_user = None
+        self._carry_spend = 0.0
+
+    def _close_users(self, spend: np.ndarray) -> None:
+        self.users += len(spend)
+        self.spend_histogram += np.bincount(
+            np.searchsorted(SPEND_BUCKETS, spend), minlength=len(SPEND_BUCKETS)
+        )
+
+    def add(self, columns: Columns) -> None:
+        if not len(columns):
+            return
+        monthly = columns.monthly_cost()
+        self.subscriptions += len(columns)
+        self.monthly_total += float(monthly.sum())
+        self.cycle_counts += np.bincount(columns.cycle, minlength=len(CYCLES))
+        self.cycle_costs += np.bincount(columns.cycle, weights=monthly, minlength=len(CYCLES))
+        self.status_counts += np.bincount(columns.status, minlength=len(STATUSES))
+        self.projection += columns.projection(self.today)
+
+        services, inverse = np.unique(np.char.lower(columns.service.astype(str)), return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(services))
+        costs = np.bincount(inverse, weights=monthly, minlength=len(services))
+        for name, count, cost in zip(services.tolist(), counts.tolist(), costs.tolist()):
+            entry = self.services.setdefault(name, [0, 0.0])
+            entry[0] += count
+            entry[1] += cost
+
+        # Per-user spend; the chunk is ordered by user, so boundaries are where the uid changes
+        users = columns.user
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+        spend = np.add.reduceat(monthly, starts)
+        if users[0] == self._carry_user:
+            spend[0] += self._carry_spend
+        elif self._carry_user is not None:
+            self._close_users(np.array([self._carry_spend]))
+        self._close_users(spend[:-1])
+        self._carry_user, self._carry_spend = users[-1], float(spend[-1])
+
+    def result(self, top_services: int = 20) -> dict:
+        if self._carry_user is not None:
+            self._close_users(np.array([self._carry_spend]))
+            self._carry_user, self._carry_spend = None, 0.0
+        ranked = sorted(self.services.items(), key=lambda item: -item[1][1])[:top_services]
+        bounds = ["inf" if np.isinf(bound) else f"{bound:g}" for bound in SPEND_BUCKETS]
+        return {
+            "subscriptions": self.subscriptions,
+            "users": self.users,
+            "monthly_total": round(self.monthly_total, 2),
+            "by_cycle": {
+                cycle: {"count": int(self.cycle_counts[index]), "monthly_cost": round(float(self.cycle_costs[index]), 2)}
+                for index, cycle in enumerate(CYCLES)
+            },
+            "by_status": {status: int(self.status_counts[index]) for index, status in enumerate(STATUSES)},
+            "top_services": [
+                {"service_name": name, "count": count, "monthly_cost": round(cost, 2)}
+                for name, (count, cost) in ranked
+            ],
+            "user_monthly_spend_histogram": {
+                f"<={bound}": int(count) for bound, count in zip(bounds, self.spend_histogram)
+            },
+            "projection": [
+                {"month": month, "amount": round(float(amount), 2)}
+                for month, amount in zip(_month_labels(self.today, PROJECTION_MONTHS), self.projection)
+            ],
+        }
@@ -1,50 +1,219 @@
 from enum import Enum
-from datetime import datetime, timedelta
-from typing import Optional, List
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, List, Dict, AsyncIterator
 import os
-from fastapi.responses import JSONResponse
+import asyncio
+import argparse
+import base64
+import calendar
+import heapq
+import importlib
+import importlib.util
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
 import jwt
 import secrets
+import hashlib
+import math
+import mmap
+import struct
+import fcntl
+import tempfile
+import random
+import time
 import uuid
-import requests
+import httpx
 from dotenv import load_dotenv
 import re 
 from typing import Tuple 
-from fastapi import FastAPI, HTTPException, Response, Request, Cookie, Depends, status, Header 
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import lru_cache
+from cachetools import TLRUCache, TTLCache
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from fastapi import FastAPI, HTTPException, Response, Request, Cookie, Depends, status, Header, Query
 from fastapi.security import HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, constr 
-from firebase_admin import credentials, firestore, auth, initialize_app
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from pydantic import BaseModel, EmailStr, TypeAdapter, constr, field_validator 
+from google.api_core.exceptions import (
+    AlreadyExists, DeadlineExceeded, FailedPrecondition, GoogleAPICallError, InternalServerError, NotFound,
+    ServiceUnavailable,
+)
+from google.cloud.firestore_v1.field_path import FieldPath
+from firebase_admin import exceptions as firebase_exceptions
+from firebase_admin import credentials, firestore, firestore_async, auth, initialize_app
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.middleware import Middleware 
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # Configuration
 load_dotenv()
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+# Rate limiting: token buckets shared by every worker through the configured backend
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "file")  # file | redis | memory
+RATE_LIMIT_FILE = os.getenv("RATE_LIMIT_FILE", os.path.join(tempfile.gettempdir(), "subtrack-ratelimit.bin"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMITS = {
+    "login": "5/minute",
+    "login-account": "10/hour",
+    "register": "5/minute",
+    "forgot-password": "3/minute",
+    "forgot-password-account": "5/hour",
+    "refresh": "30/minute",
+}
 
 # Firebase
 FIREBASE_API_KEY = os.getenv("FIREBASE_API_KEY")
-firebase_cred = credentials.Certificate({
-    "type": os.getenv("FIREBASE_TYPE"),
-    "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-    "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-    "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace('\\n', '\n'),
-    "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-    "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-    "auth_uri": os.getenv("FIREBASE_AUTH_URI"),
-    "token_uri": os.getenv("FIREBASE_TOKEN_URI"),
-    "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_CERT_URL"),
-    "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_CERT_URL"),
-    "universe_domain": os.getenv("FIREBASE_UNIVERSE_DOMAIN")
-})
-firebase_app = initialize_app(firebase_cred)
-db = firestore.client()
+# Open the Firestore channel and fetch ID token certs during startup
+FIREBASE_WARMUP = os.getenv("FIREBASE_WARMUP", "false").lower() in ("1", "true", "yes")
+
+# Firebase clients are created on first use rather than at import, so
+# importing this module stays cheap (see benchmarks/profile_startup.py).
+_firebase_app = None
+_db = None
+_sync_db = None
+
+def firebase_credentials() -> credentials.Certificate:
+    return credentials.Certificate({
+        "type": os.getenv("FIREBASE_TYPE"),
+        "project_id": os.getenv("FIREBASE_PROJECT_ID"),
+        "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
+        "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace('\\n', '\n'),
+        "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
+        "client_id": os.getenv("FIREBASE_CLIENT_ID"),
+        "auth_uri": os.getenv("FIREBASE_AUTH_URI"),
+        "token_uri": os.getenv("FIREBASE_TOKEN_URI"),
+        "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_CERT_URL"),
+        "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_CERT_URL"),
+        "universe_domain": os.getenv("FIREBASE_UNIVERSE_DOMAIN")
+    })
+
+def get_firebase_app(cred: Optional[credentials.Certificate] = None):
+    global _firebase_app
+    if _firebase_app is None:
+        _firebase_app = initialize_app(cred or firebase_credentials())
+    return _firebase_app
+
+def get_db():
+    global _db
+    if _db is None:
+        _db = firestore_async.client(get_firebase_app())
+    return _db
+
+def get_sync_db():
+    """Synchronous client, used only for on_snapshot listeners (the async client has none)"""
+    global _sync_db
+    if _sync_db is None:
+        _sync_db = firestore.client(get_firebase_app())
+    return _sync_db
+
+async def warm_up_firestore() -> None:
+    """Open the gRPC channel (and mint its access token) with one small read"""
+    await get_db().collection('users').document('_warmup').get()
+
+async def warm_up_token_certs() -> None:
+    """Fetch the ID token signing certs through the verifier's own caching session"""
+    verifier = auth._get_client(get_firebase_app())._token_verifier
+    await asyncio.to_thread(verifier.request, verifier.id_token_verifier.cert_url, method='GET')
+
+# Identity Toolkit HTTP client
+IDENTITY_TOOLKIT_URL = os.getenv("IDENTITY_TOOLKIT_URL", "https://identitytoolkit.googleapis.com/v1")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+
+# Verified ID token cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+
+# Subscription read cache
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "1024"))
+SUBSCRIPTION_CACHE_TTL = float(os.getenv("SUBSCRIPTION_CACHE_TTL", "60"))
+
+# Concurrent identical reads share one call; callers beyond this many per
+# key make their own instead of piling onto a slow one
+SINGLE_FLIGHT_MAX_WAITERS = int(os.getenv("SINGLE_FLIGHT_MAX_WAITERS", "100"))
+
+# User record / profile caches; the TTL bounds how long a disabled or
+# deleted account can keep refreshing from this worker
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Subscription list pagination, filtering and projection
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+LIST_FIELDS = ('service_name', 'cost', 'billing_cycle', 'next_renewal_date', 'status', 'user_id', 'created_at', 'updated_at')
+# `sort` values and the stored field each orders by; every combination with
+# the status / billing_cycle filters has a composite index in firestore.indexes.json
+SORT_FIELDS = {'next_renewal_date': 'renewal_at', 'cost': 'cost', 'service_name': 'service_name'}
+
+# Subscription totals
+# Per-write markers in `subscription_totals_events` that let API writes and
+# the maintainSubscriptionTotals trigger apply each write's delta once;
+# removed after this long by the Firestore TTL policy on `expire_at`
+TOTALS_EVENT_TTL_DAYS = 7
+
+# Bulk writes
+BATCH_WRITE_LIMIT = 500
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", "2000"))
+CONDITIONAL_WRITE_ATTEMPTS = 3
+
+# Email outbox
+OUTBOX_WORKER = os.getenv("OUTBOX_WORKER", "true").lower() in ("1", "true", "yes")
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_SECONDS = 2.0
+OUTBOX_BACKOFF_CAP_SECONDS = 600.0
+# Failed messages are kept this long for inspection, then removed by the
+# Firestore TTL policy on `expire_at` (firestore.indexes.json)
+OUTBOX_FAILED_RETENTION_DAYS = int(os.getenv("OUTBOX_FAILED_RETENTION_DAYS", "7"))
+
+# Renewals
+# The processRenewals function in functions/ rolls renewals and queues
+# reminders every hour on Cloud Scheduler, whatever runs here. The in-process
+# scheduler only adds on-time rolls between those runs; keep
+# RENEWAL_REMINDER_DAYS the same on both sides.
+RENEWAL_SCHEDULER = os.getenv("RENEWAL_SCHEDULER", "false").lower() in ("1", "true", "yes")
+RENEWAL_REMINDER_DAYS = int(os.getenv("RENEWAL_REMINDER_DAYS", "3"))
+RENEWAL_REFILL_SECONDS = float(os.getenv("RENEWAL_REFILL_SECONDS", "3600"))
+DEFAULT_RENEWAL_WINDOW_DAYS = 30
+MAX_RENEWAL_WINDOW_DAYS = 366
+
+# Fleet analytics batch job: documents read and aggregated per chunk
+ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", "5000"))
+ANALYTICS_FIELDS = ['user_id', 'service_name', 'cost', 'billing_cycle', 'status', 'renewal_at', 'next_renewal_date']
+# analytics.py sits next to this module, which runs both as `task.main` and as
+# `main` from task/. It is imported (with NumPy) on first use, so check here
+# that it can be found rather than failing on the first analytics request.
+ANALYTICS_MODULE = f"{__package__}.analytics" if __package__ else "analytics"
+if importlib.util.find_spec(ANALYTICS_MODULE) is None:
+    raise ImportError(f"Cannot find {ANALYTICS_MODULE}")
+
+# Change feed (SSE)
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+CHANGE_FEED_QUEUE_SIZE = 100
+CHANGE_FEED_MAX_PER_USER = int(os.getenv("CHANGE_FEED_MAX_PER_USER", "5"))
+CHANGE_FEED_MAX_SESSIONS = int(os.getenv("CHANGE_FEED_MAX_SESSIONS", "1000"))
+
+# Deadlines: every dependency call gets the smaller of its own timeout and
+# what is left of the request's budget (HTTP_READ_TIMEOUT above is Identity Toolkit's)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "15"))
+FIRESTORE_TIMEOUT = float(os.getenv("FIRESTORE_TIMEOUT", "5"))
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", "5"))
+# Idempotent reads only: attempts in total, full-jitter backoff between them
+READ_RETRY_ATTEMPTS = int(os.getenv("READ_RETRY_ATTEMPTS", "3"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("RETRY_BACKOFF_SECONDS", "0.05"))
+RETRY_BACKOFF_CAP_SECONDS = float(os.getenv("RETRY_BACKOFF_CAP_SECONDS", "1"))
+# A single-document get still pending after this long races a second copy; 0 disables hedging
+FIRESTORE_HEDGE_AFTER = float(os.getenv("FIRESTORE_HEDGE_AFTER_MS", "0")) / 1000
+# Identity Toolkit circuit breaker
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
 
 # JWT
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
@@ -55,18 +224,327 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
 # Security Headers Middleware
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Content-Security-Policy"] = "default-src 'self'"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        return response
-
-# FastAPI setup with middleware
-middleware = [
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"content-security-policy", b"default-src 'self'"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+]
+
+class SecurityHeadersMiddleware:
+    """Pure ASGI middleware appending the precomputed SECURITY_HEADERS to every HTTP response"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *SECURITY_HEADERS]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+# Metrics
+# Cheap enough to leave on: each observation is a dict lookup and a locked add.
+# With several workers, set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates them.
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests currently being handled",
+    ["method"], multiprocess_mode="livesum"
+)
+FIRESTORE_CALLS = Counter(
+    "firestore_calls_total", "Firestore calls by collection and operation",
+    ["collection", "operation"]
+)
+FIRESTORE_SECONDS = Histogram(
+    "firestore_call_duration_seconds", "Firestore call latency by collection and operation",
+    ["collection", "operation"]
+)
+AUTH_CALL_SECONDS = Histogram(
+    "auth_call_duration_seconds", "Outbound Firebase Auth / Identity Toolkit call latency",
+    ["call", "outcome"]
+)
+TOKEN_CACHE_LOOKUPS = Counter(
+    "token_cache_lookups_total", "Verified ID token cache lookups", ["result"]
+)
+CHANGE_FEED_SESSIONS = Gauge(
+    "change_feed_sessions", "Open change feed (SSE) sessions", multiprocess_mode="livesum"
+)
+CHANGE_FEED_LISTENERS = Gauge(
+    "change_feed_listeners", "Firestore snapshot listeners behind the change feed", multiprocess_mode="livesum"
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    "single_flight_calls_total",
+    "Coalesced reads by query shape; role=shared counts Firestore calls saved",
+    ["query", "role"]
+)
+CHANGE_FEED_RESYNCS = Counter(
+    "change_feed_resyncs_total", "Slow change feed sessions whose backlog was replaced by a snapshot"
+)
+DEPENDENCY_TIMEOUTS = Counter(
+    "dependency_timeouts_total", "Dependency calls abandoned at their timeout or the request deadline",
+    ["dependency"]
+)
+DEPENDENCY_RETRIES = Counter(
+    "dependency_retries_total", "Idempotent reads retried after a transient failure", ["dependency"]
+)
+HEDGED_READS = Counter(
+    "firestore_hedged_reads_total", "Firestore gets that raced a second copy; winner=hedge when it answered first",
+    ["winner"]
+)
+CIRCUIT_STATE = Gauge(
+    "circuit_breaker_state", "0 closed, 1 half-open, 2 open", ["dependency"], multiprocess_mode="max"
+)
+
+@asynccontextmanager
+async def firestore_call(collection: str, operation: str, timeout: Optional[float] = FIRESTORE_TIMEOUT):
+    """Time one Firestore call, bounded by `timeout` and the request deadline unless timeout is None (sweeps, streams)"""
+    start = time.perf_counter()
+    try:
+        async with asyncio.timeout(None if timeout is None else call_timeout("firestore", timeout)):
+            yield
+    except TimeoutError as e:
+        raise dependency_timed_out("firestore") from e
+    finally:
+        FIRESTORE_CALLS.labels(collection, operation).inc()
+        FIRESTORE_SECONDS.labels(collection, operation).observe(time.perf_counter() - start)
+
+@contextmanager
+def auth_call(call: str):
+    start, outcome = time.perf_counter(), "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        AUTH_CALL_SECONDS.labels(call, outcome).observe(time.perf_counter() - start)
+
+# Deadlines, retries and hedging
+# A request's deadline lives in a context variable set by DeadlineMiddleware,
+# so repository code deep in the call stack sees it without threading it
+# through every signature. Outside a request (workers, CLI) there is none and
+# only the per-dependency timeouts apply.
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class DependencyTimeout(Exception):
+    """A dependency call ran out of time; answered with 504"""
+
+    def __init__(self, dependency: str):
+        super().__init__(f"{dependency} call timed out")
+        self.dependency = dependency
+
+class CircuitOpenError(Exception):
+    """A dependency's circuit is open and the call was not attempted; answered with 503"""
+
+    def __init__(self, dependency: str, retry_after: float):
+        super().__init__(f"{dependency} unavailable, retry in {retry_after:.0f}s")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+class DependencyUnavailable(Exception):
+    """A dependency could not be reached or answered 429 / 5xx; answered with 503"""
+
+    def __init__(self, dependency: str, reason: str):
+        super().__init__(f"{dependency} unavailable: {reason}")
+        self.dependency = dependency
+
+# Let these through broad `except Exception` handlers: they are not the
+# caller's fault and must reach the 504 / 503 handlers as themselves
+DEPENDENCY_FAILURES = (DependencyTimeout, CircuitOpenError, DependencyUnavailable)
+
+def dependency_timed_out(dependency: str) -> DependencyTimeout:
+    DEPENDENCY_TIMEOUTS.labels(dependency).inc()
+    return DependencyTimeout(dependency)
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current request's deadline, None outside a request"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def call_timeout(dependency: str, timeout: Optional[float]) -> Optional[float]:
+    """The tighter of `timeout` and the remaining budget; raises if the budget is spent"""
+    remaining = remaining_budget()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise dependency_timed_out(dependency)
+    return remaining if timeout is None else min(timeout, remaining)
+
+class DeadlineMiddleware:
+    """Pure ASGI middleware starting each HTTP request's deadline budget"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = request_deadline.set(time.monotonic() + REQUEST_DEADLINE_SECONDS)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+
+# Transient failures worth another attempt; anything else (NotFound, bad
+# tokens, permission errors) fails the same way every time
+FIRESTORE_RETRYABLE = (DependencyTimeout, ServiceUnavailable, DeadlineExceeded, InternalServerError)
+AUTH_RETRYABLE = (
+    DependencyTimeout, firebase_exceptions.UnavailableError, firebase_exceptions.DeadlineExceededError,
+)
+
+async def with_retries(dependency: str, attempt, retryable: tuple):
+    """Await attempt() up to READ_RETRY_ATTEMPTS times with full-jitter backoff. Only for idempotent calls."""
+    for number in range(READ_RETRY_ATTEMPTS):
+        try:
+            return await attempt()
+        except retryable:
+            delay = random.uniform(0, min(RETRY_BACKOFF_CAP_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** number))
+            remaining = remaining_budget()
+            if number == READ_RETRY_ATTEMPTS - 1 or (remaining is not None and delay >= remaining):
+                raise
+        DEPENDENCY_RETRIES.labels(dependency).inc()
+        await asyncio.sleep(delay)
+
+async def hedged(call, after: float):
+    """Await call(); if it has not answered within `after` seconds, race a second call and keep the first success"""
+    first = asyncio.ensure_future(call())
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=after)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(call())
+        pending.add(second)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGED_READS.labels("hedge" if task is second else "original").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def firestore_read(collection: str, operation: str, call, hedge: bool = False):
+    """An idempotent Firestore read: timed out, retried and, for single-document gets, optionally hedged"""
+    async def attempt():
+        async with firestore_call(collection, operation):
+            if hedge and FIRESTORE_HEDGE_AFTER > 0:
+                return await hedged(call, FIRESTORE_HEDGE_AFTER)
+            return await call()
+    return await with_retries("firestore", attempt, FIRESTORE_RETRYABLE)
+
+async def fetch_all(query) -> list:
+    """Every snapshot a query streams, as one awaitable for firestore_read"""
+    return [doc async for doc in query.stream()]
+
+async def auth_admin(call: str, fn, *args, retry: bool = False, **kwargs):
+    """Run a blocking firebase_admin.auth call off the event loop under AUTH_TIMEOUT. Set retry only for reads."""
+    async def attempt():
+        with auth_call(call):
+            try:
+                return await asyncio.wait_for(
+                    asyncio.to_thread(fn, *args, **kwargs), call_timeout("auth", AUTH_TIMEOUT)
+                )
+            except TimeoutError as e:
+                raise dependency_timed_out("auth") from e
+    if retry:
+        return await with_retries("auth", attempt, AUTH_RETRYABLE)
+    return await attempt()
+
+class CircuitBreaker:
+    """Fails calls fast while a dependency is degraded (closed -> open -> half-open)"""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, dependency: str, failure_threshold: int, reset_seconds: float):
+        self.dependency = dependency
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._state = CIRCUIT_STATE.labels(dependency)
+        self._state.set(self.CLOSED)
+
+    @property
+    def state(self) -> int:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def check(self) -> None:
+        state = self.state
+        self._state.set(state)
+        if state == self.OPEN:
+            raise CircuitOpenError(self.dependency, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def record_success(self) -> None:
+        self.failures, self.opened_at = 0, None
+        self._state.set(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._state.set(self.OPEN)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency and in-flight requests, labelled by route template"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(method, route.path if route else "unmatched", status_code) \
+                .observe(time.perf_counter() - start)
+
+# Middleware stack, outermost first:
+#   1. HTTPSRedirectMiddleware (production only) redirects plain HTTP before any other work.
+#   2. MetricsMiddleware times everything below it, including CORS and error responses.
+#   3. DeadlineMiddleware starts the request's budget for dependency calls.
+#   4. SecurityHeadersMiddleware stamps every response, including CORS preflights and errors.
+#   5. CORSMiddleware answers preflights and adds CORS headers to API responses.
+middleware = []
+if os.getenv("ENVIRONMENT") == "production":
+    middleware.append(Middleware(HTTPSRedirectMiddleware))
+middleware += [
+    Middleware(MetricsMiddleware),
+    Middleware(DeadlineMiddleware),
     Middleware(SecurityHeadersMiddleware),
     Middleware(
         CORSMiddleware,
@@ -74,16 +552,47 @@ middleware = [
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
     )
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled keep-alive client shared by every Identity Toolkit call
+    app.state.http_client = httpx.AsyncClient(
+        base_url=IDENTITY_TOOLKIT_URL,
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+    )
+    app.state.rate_limiter = RateLimiter(create_rate_limit_backend())
+    # The Admin SDK auth helpers use the default app, so it must exist before serving
+    get_firebase_app()
+    if FIREBASE_WARMUP:
+        # Best effort: a failed warm-up only means the first request pays instead
+        for warm_up in (warm_up_firestore, warm_up_token_certs):
+            try:
+                await warm_up()
+            except Exception as e:
+                print(f"Firebase warm-up step {warm_up.__name__} failed: {e}")
+    workers = []
+    if OUTBOX_WORKER:
+        workers.append(asyncio.create_task(email_outbox.run()))
+    if RENEWAL_SCHEDULER:
+        workers.append(asyncio.create_task(renewal_scheduler.run()))
+    try:
+        yield
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await app.state.http_client.aclose()
+        await app.state.rate_limiter.backend.close()
+        change_feed.close_all()
+
 # FastAPI setup
-app = FastAPI(middleware=middleware)
+app = FastAPI(middleware=middleware, lifespan=lifespan)
 security = HTTPBearer()
 
-if os.getenv("ENVIRONMENT") == "production":
-    app.add_middleware(HTTPSRedirectMiddleware)
-
 # # CORS configuration
 # app.add_middleware(
 #     CORSMiddleware,
@@ -93,15 +602,1292 @@ if os.getenv("ENVIRONMENT") == "production":
 #     allow_headers=["*"],
 # )
 
-# Rate limiting for auth endpoints
-@app.exception_handler(RateLimitExceeded)
-async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
-    return HTTPException(
-        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-        detail="Too many requests"
-    )
+# Rate limiting
+RATE_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+@lru_cache(maxsize=None)
+def parse_rate(rate: str) -> Tuple[float, float]:
+    """'5/minute' -> (bucket capacity, tokens refilled per second)"""
+    count, period = rate.split("/")
+    return float(count), float(count) / RATE_PERIODS[period]
+
+def take_token(
+    tokens: float, updated: float, now: float, capacity: float, refill: float, cost: float = 1.0
+) -> Tuple[bool, float]:
+    """Refill a bucket up to `now` and, if a token is left, take `cost` of them; returns (allowed, tokens left)"""
+    tokens = min(capacity, tokens + max(0.0, now - updated) * refill)
+    if tokens >= 1:
+        return True, tokens - cost
+    return False, tokens
+
+class MemoryTokenBucketBackend:
+    """Per-process buckets; only for single-worker development and benchmarks."""
+
+    def __init__(self):
+        self._buckets = TTLCache(maxsize=100_000, ttl=86400)
+
+    async def acquire(self, key: str, capacity: float, refill: float, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.time()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        allowed, tokens = take_token(tokens, updated, now, capacity, refill, cost)
+        self._buckets[key] = (tokens, now)
+        return allowed, tokens
+
+    async def close(self) -> None:
+        pass
+
+class FileTokenBucketBackend:
+    """Buckets in a memory-mapped, flock-guarded hash table shared by all workers on the host"""
+
+    SLOT = struct.Struct("<Qdd")
+    PROBES = 8
+
+    def __init__(self, path: str, slots: int = 65536):
+        self._slots = slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * self.SLOT.size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+
+    async def acquire(self, key: str, capacity: float, refill: float, cost: float = 1.0) -> Tuple[bool, float]:
+        key_hash = int(key[:16], 16) or 1  # 0 marks an empty slot
+        now = time.time()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, tokens, updated = self._find_slot(key_hash, capacity, now)
+            allowed, tokens = take_token(tokens, updated, now, capacity, refill, cost)
+            self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return allowed, tokens
+
+    def _find_slot(self, key_hash: int, capacity: float, now: float) -> Tuple[int, float, float]:
+        oldest_offset, oldest_updated = None, None
+        for probe in range(self.PROBES):
+            offset = ((key_hash + probe) % self._slots) * self.SLOT.size
+            slot_hash, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                return offset, capacity, now
+            if oldest_updated is None or updated < oldest_updated:
+                oldest_offset, oldest_updated = offset, updated
+        return oldest_offset, capacity, now
+
+    async def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+class RedisTokenBucketBackend:
+    """Buckets in Redis, refilled and taken by one Lua script on the server clock"""
+
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url: str):
+        import redis.asyncio
+
+        self._client = redis.asyncio.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    async def acquire(self, key: str, capacity: float, refill: float, cost: float = 1.0) -> Tuple[bool, float]:
+        allowed, tokens = await self._script(keys=[f"ratelimit:{key}"], args=[capacity, refill, cost])
+        return bool(allowed), float(tokens)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+def create_rate_limit_backend():
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisTokenBucketBackend(RATE_LIMIT_REDIS_URL)
+    if RATE_LIMIT_BACKEND == "memory":
+        return MemoryTokenBucketBackend()
+    return FileTokenBucketBackend(RATE_LIMIT_FILE)
+
+# check() takes a token per call. Scopes that should only count failures
+# (a per-account login limit anyone could otherwise drain) check with
+# cost=0 up front and charge() once the attempt has failed.
+class RateLimiter:
+    """Applies RATE_LIMITS through a shared token-bucket backend, keyed by a hash of scope and identity; fails open"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def check(self, scope: str, identity: str, cost: float = 1.0) -> None:
+        capacity, refill = parse_rate(RATE_LIMITS[scope])
+        key = hashlib.sha256(f"{scope}:{identity}".encode()).hexdigest()
+        try:
+            allowed, tokens = await self.backend.acquire(key, capacity, refill, cost)
+        except Exception as e:
+            print(f"Rate limit backend error, allowing request: {e}")
+            return
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil((1 - tokens) / refill))}
+            )
+
+    async def charge(self, scope: str, identity: str) -> None:
+        """Take a token without rejecting the current request"""
+        capacity, refill = parse_rate(RATE_LIMITS[scope])
+        key = hashlib.sha256(f"{scope}:{identity}".encode()).hexdigest()
+        try:
+            await self.backend.acquire(key, capacity, refill)
+        except Exception as e:
+            print(f"Rate limit backend error, not charged: {e}")
+
+def client_address(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def rate_limit(scope: str):
+    """Route dependency limiting `scope` per client address"""
+    async def check_rate_limit(request: Request) -> None:
+        await request.app.state.rate_limiter.check(scope, client_address(request))
+    return Depends(check_rate_limit)
+
+# Caches
+class TokenCache:
+    """Bounded LRU of decoded ID token claims, each expiring at the token's own `exp`"""
+
+    def __init__(self, maxsize: int):
+        self._cache = TLRUCache(
+            maxsize=maxsize,
+            ttu=lambda _key, claims, _now: claims['exp'],
+            timer=time.time
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        claims = self._cache.get(self._key(token))
+        if claims is None:
+            self.misses += 1
+            TOKEN_CACHE_LOOKUPS.labels("miss").inc()
+        else:
+            self.hits += 1
+            TOKEN_CACHE_LOOKUPS.labels("hit").inc()
+        return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        self._cache[self._key(token)] = claims
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+# Writes through this worker update cached sets in place, drop the set's
+# version and bump a generation counter so a load that raced a write is not stored.
+class SubscriptionCache:
+    """Per-user read-through cache of subscription sets and their collection version, LRU bounded with a TTL"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.generation = 0
+
+    def get_version(self, user_id: str) -> Optional[datetime]:
+        return self._versions.get(user_id) if user_id in self._cache else None
+
+    def get_all(self, user_id: str) -> Optional[List[dict]]:
+        subs = self._cache.get(user_id)
+        return None if subs is None else [dict(sub) for sub in subs.values()]
+
+    def get(self, user_id: str, subscription_id: str) -> Tuple[bool, Optional[dict]]:
+        """Return (loaded, subscription); a miss in a loaded set means it does not exist."""
+        subs = self._cache.get(user_id)
+        if subs is None:
+            return False, None
+        sub = subs.get(subscription_id)
+        return True, None if sub is None else dict(sub)
+
+    def set_all(self, user_id: str, subs: List[dict], generation: int, version: Optional[datetime] = None) -> None:
+        if generation == self.generation:
+            self._cache[user_id] = {sub['subscription_id']: dict(sub) for sub in subs}
+            if version is None:
+                self._versions.pop(user_id, None)
+            else:
+                self._versions[user_id] = version
+
+    def put(self, user_id: str, subscription_id: str, data: dict) -> None:
+        self.generation += 1
+        self._versions.pop(user_id, None)
+        subs = self._cache.get(user_id)
+        if subs is not None:
+            subs[subscription_id] = {**subs.get(subscription_id, {}), **data, 'subscription_id': subscription_id}
+
+    def remove(self, user_id: str, subscription_id: str) -> None:
+        self.generation += 1
+        self._versions.pop(user_id, None)
+        subs = self._cache.get(user_id)
+        if subs is not None:
+            subs.pop(subscription_id, None)
+
+subscription_cache = SubscriptionCache(SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_CACHE_TTL)
+
+# The call runs as its own task, so one caller going away does not cancel it
+# for the rest. Subscription reads key on the cache generation, so a read
+# never joins a flight that started before this worker's last write.
+class SingleFlight:
+    """Coalesces concurrent identical reads into one in-flight call; results are shared and read-only"""
+
+    def __init__(self, max_waiters: int):
+        self.max_waiters = max_waiters
+        self._flights = {}
+
+    async def do(self, key: tuple, call):
+        shape = key[0]
+        flight = self._flights.get(key)
+        if flight is not None:
+            task, waiters = flight
+            if waiters < self.max_waiters:
+                self._flights[key] = (task, waiters + 1)
+                SINGLE_FLIGHT_CALLS.labels(shape, 'shared').inc()
+                return await asyncio.shield(task)
+            SINGLE_FLIGHT_CALLS.labels(shape, 'overflow').inc()
+            return await call()
+
+        task = asyncio.ensure_future(call())
+        self._flights[key] = (task, 0)
+        task.add_done_callback(lambda done: self._land(key, done))
+        SINGLE_FLIGHT_CALLS.labels(shape, 'leader').inc()
+        return await asyncio.shield(task)
+
+    def _land(self, key: tuple, task: asyncio.Future) -> None:
+        if self._flights.get(key, (None,))[0] is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller went away
+
+read_flights = SingleFlight(SINGLE_FLIGHT_MAX_WAITERS)
+
+# Data access
+@dataclass(frozen=True)
+class ListQuery:
+    """Filters, order, projection and page of a subscription list read"""
+    status: Optional[str] = None
+    billing_cycle: Optional[str] = None
+    order_field: Optional[str] = None  # Stored field; None orders by document id
+    descending: bool = False
+    fields: Optional[Tuple[str, ...]] = None
+    limit: Optional[int] = None
+    after_id: Optional[str] = None
+
+    def matches(self, sub: dict) -> bool:
+        return (self.status is None or sub['status'] == self.status) \
+            and (self.billing_cycle is None or sub['billing_cycle'] == self.billing_cycle)
+
+    def project(self, sub: dict) -> dict:
+        if self.fields is None:
+            return sub
+        return {**{field: sub[field] for field in self.fields if field in sub}, 'subscription_id': sub['subscription_id']}
+
+    def apply(self, subs: List[dict]) -> Optional[Tuple[List[dict], Optional[str]]]:
+        """Run the query over a user's full list in memory, as Firestore would; None when the cursor is not in it"""
+        subs = [sub for sub in subs if self.matches(sub)]
+        if self.order_field:
+            # As in Firestore: documents without the field are left out, nulls sort first
+            subs = [sub for sub in subs if self.order_field in sub]
+            subs.sort(
+                key=lambda sub: (sub[self.order_field] is not None, sub[self.order_field], sub['subscription_id']),
+                reverse=self.descending
+            )
+        else:
+            subs.sort(key=lambda sub: sub['subscription_id'])
+        start = 0
+        if self.after_id:
+            ids = [sub['subscription_id'] for sub in subs]
+            if self.after_id not in ids:
+                return None
+            start = ids.index(self.after_id) + 1
+        end = len(subs) if self.limit is None else start + self.limit
+        page = [self.project(sub) for sub in subs[start:end]]
+        return page, page[-1]['subscription_id'] if page and end < len(subs) else None
+
+class UserRepository:
+    """Async access to the `users` collection, remembering which profile docs exist"""
+
+    def __init__(self, client_factory):
+        self._client_factory = client_factory
+        self._known = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+    @property
+    def collection(self):
+        return self._client_factory().collection('users')
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        return await read_flights.do(('users.get', user_id), lambda: self._get(user_id))
+
+    async def _get(self, user_id: str) -> Optional[dict]:
+        doc = await firestore_read('users', 'read', self.collection.document(user_id).get, hedge=True)
+        return doc.to_dict() if doc.exists else None
+
+    async def exists(self, user_id: str) -> bool:
+        if user_id in self._known:
+            return True
+        if await self.get(user_id) is None:
+            return False
+        self._known[user_id] = True
+        return True
+
+    async def create(self, user_id: str, data: dict) -> None:
+        async with firestore_call('users', 'write'):
+            await self.collection.document(user_id).set(data)
+        self._known[user_id] = True
+
+def monthly_cost(sub: dict) -> float:
+    """Monthly-equivalent cost a subscription adds to its owner's total"""
+    if Status(sub['status']) != Status.active:
+        return 0.0
+    return sub['cost'] / (12 if BillingCycle(sub['billing_cycle']) == BillingCycle.yearly else 1)
+
+def version_tag(updated_at: Optional[datetime]) -> str:
+    """Strong ETag for a timestamp version; naive (as written) and UTC (as read back) forms match"""
+    if updated_at is None:
+        return '"0"'
+    if updated_at.tzinfo is not None:
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return f'"{updated_at.strftime("%Y%m%dT%H%M%S%f")}"'
+
+def subscription_version(sub: dict) -> str:
+    """Strong ETag for a subscription, derived from its `updated_at`"""
+    return version_tag(sub.get('updated_at'))
+
+# Exactly what renewalDay() in functions/ accepts; date.fromisoformat alone
+# also takes forms such as 20261101 and 2026-W44-1
+RENEWAL_DATE_PATTERN = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})(?:T|\Z)')
+
+def renewal_date(value: str) -> date:
+    """Calendar date of a `next_renewal_date`: YYYY-MM-DD, or an ISO timestamp starting with one"""
+    match = RENEWAL_DATE_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"Expected YYYY-MM-DD, got {value!r}")
+    return date(*map(int, match.groups()))
+
+def renewal_timestamp(day: date) -> datetime:
+    """Sortable `renewal_at` value stored next to `next_renewal_date`: midnight UTC"""
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+def with_renewal_at(data: dict) -> dict:
+    if 'next_renewal_date' not in data:
+        return data
+    return {**data, 'renewal_at': renewal_timestamp(renewal_date(data['next_renewal_date']))}
+
+def add_months(day: date, months: int) -> date:
+    """Shift by whole months, clamping to the end of shorter months"""
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    month += 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+def roll_renewal_date(day: date, billing_cycle: "BillingCycle", today: date) -> date:
+    """First renewal after `today`, stepping from `day` one billing cycle at a time"""
+    step = 12 if BillingCycle(billing_cycle) == BillingCycle.yearly else 1
+    months = 0
+    while add_months(day, months) <= today:
+        months += step
+    return add_months(day, months)
+
+def empty_totals(user_id: str) -> dict:
+    return {
+        'user_id': user_id,
+        'monthly_total': 0.0,
+        'count_by_cycle': {cycle.value: 0 for cycle in BillingCycle},
+        'count_by_status': {status.value: 0 for status in Status},
+    }
+
+def totals_delta(user_id: str, changes: List[Tuple[Optional[dict], Optional[dict]]]) -> dict:
+    """Increment transforms applying each (old, new) change to a totals doc (merge-set this)"""
+    monthly_total = 0.0
+    cycles, statuses = {}, {}
+    for old, new in changes:
+        for sub, sign in ((old, -1), (new, 1)):
+            if sub is None:
+                continue
+            monthly_total += sign * monthly_cost(sub)
+            cycle = BillingCycle(sub['billing_cycle']).value
+            cycles[cycle] = cycles.get(cycle, 0) + sign
+            sub_status = Status(sub['status']).value
+            statuses[sub_status] = statuses.get(sub_status, 0) + sign
+
+    delta = {
+        'user_id': user_id,
+        'monthly_total': firestore.Increment(monthly_total),
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    }
+    # Empty maps would overwrite the stored counts under merge, so leave them out
+    cycles = {k: firestore.Increment(v) for k, v in cycles.items() if v}
+    statuses = {k: firestore.Increment(v) for k, v in statuses.items() if v}
+    if cycles:
+        delta['count_by_cycle'] = cycles
+    if statuses:
+        delta['count_by_status'] = statuses
+    return delta
+
+# The maintainSubscriptionTotals trigger in functions/ derives the same id
+# from the event's `before` snapshot, so keep the two in step.
+def totals_event_id(subscription_id: str, replaced_update_time: Optional[datetime]) -> str:
+    """Marker id for one write: the subscription plus the update time of the version it replaced"""
+    if replaced_update_time is None:
+        return f"{subscription_id}@created"
+    stamp = replaced_update_time.timestamp_pb()
+    return f"{subscription_id}@{stamp.seconds}.{stamp.nanos:09d}"
+
+# Failures that end one bulk chunk without failing the whole request: the
+# chunks before it are already committed, so the caller needs per-item results
+CHUNK_FAILURES = (GoogleAPICallError, DependencyTimeout)
+
+def chunk_failure_code(error: Exception) -> int:
+    """503 when the chunk was rejected; 504 when it timed out and may have been applied"""
+    return 504 if isinstance(error, DependencyTimeout) else 503
+
+# Every write applies its delta to the owner's `subscription_totals` doc in
+# the same commit, with a marker in `subscription_totals_events` that the
+# maintainSubscriptionTotals trigger also claims: the trigger covers writers
+# that bypass the API (the dashboard) and skips writes already applied here.
+class SubscriptionRepository:
+    """Async access to the `subscriptions` collection, cached per user"""
+
+    def __init__(self, client_factory, cache: SubscriptionCache):
+        self._client_factory = client_factory
+        self.cache = cache
+
+    @property
+    def client(self):
+        return self._client_factory()
+
+    @property
+    def collection(self):
+        return self.client.collection('subscriptions')
+
+    @property
+    def totals(self):
+        return self.client.collection('subscription_totals')
+
+    @property
+    def totals_events(self):
+        return self.client.collection('subscription_totals_events')
+
+    async def _commit(self, batch, collection: str = 'subscriptions'):
+        async with firestore_call(collection, 'commit'):
+            return await batch.commit()
+
+    def _write_totals(self, writer, changes: List[Tuple[str, Optional[datetime], Optional[dict], Optional[dict]]]) -> None:
+        """Add the totals deltas and event markers for (id, replaced update time, old, new) changes"""
+        expire_at = datetime.now(timezone.utc) + timedelta(days=TOTALS_EVENT_TTL_DAYS)
+        by_user = {}
+        for subscription_id, replaced_update_time, old, new in changes:
+            writer.create(
+                self.totals_events.document(totals_event_id(subscription_id, replaced_update_time)),
+                {'expire_at': expire_at}
+            )
+            if old and new and old['user_id'] != new['user_id']:
+                by_user.setdefault(old['user_id'], []).append((old, None))
+                by_user.setdefault(new['user_id'], []).append((None, new))
+            else:
+                by_user.setdefault((new or old)['user_id'], []).append((old, new))
+        for user_id, pairs in by_user.items():
+            writer.set(self.totals.document(user_id), totals_delta(user_id, pairs), merge=True)
+
+    async def list_for_user(self, user_id: str) -> List[dict]:
+        subs, _ = await self.list_with_version(user_id)
+        return subs
+
+    async def list_with_version(self, user_id: str) -> Tuple[List[dict], Optional[datetime]]:
+        """The user's subscriptions and the collection version they are at least as new as (None when unknown)"""
+        cached = self.cache.get_all(user_id)
+        if cached is not None:
+            return cached, self.cache.get_version(user_id)
+        subs, version = await read_flights.do(
+            ('subscriptions.list', user_id, self.cache.generation), lambda: self._load_with_version(user_id)
+        )
+        return [dict(sub) for sub in subs], version
+
+    async def _load_with_version(self, user_id: str) -> Tuple[List[dict], Optional[datetime]]:
+        generation = self.cache.generation
+        totals = await firestore_read('subscription_totals', 'read', self.totals.document(user_id).get, hedge=True)
+        version = totals.to_dict().get('updated_at') if totals.exists else None
+        query = self.collection.where('user_id', '==', user_id)
+        docs = await firestore_read('subscriptions', 'query', lambda: fetch_all(query))
+        subs = [{**doc.to_dict(), 'subscription_id': doc.id} for doc in docs]
+        newest = max((doc.update_time for doc in docs), default=None)
+        if version is not None and newest is not None and newest > version:
+            version = newest
+        self.cache.set_all(user_id, subs, generation, version)
+        return subs, version
+
+    async def _query(self, user_id: str, spec: ListQuery):
+        """Firestore query for `spec`, positioned after its cursor"""
+        query = self.collection.where('user_id', '==', user_id)
+        if spec.status is not None:
+            query = query.where('status', '==', spec.status)
+        if spec.billing_cycle is not None:
+            query = query.where('billing_cycle', '==', spec.billing_cycle)
+        if spec.order_field:
+            direction = firestore.Query.DESCENDING if spec.descending else firestore.Query.ASCENDING
+            query = query.order_by(spec.order_field, direction=direction)
+        else:
+            query = query.order_by(FieldPath.document_id())
+        if spec.after_id:
+            # Resuming a sort needs the cursor's sort value; an unknown cursor fails either way
+            cursor = await firestore_read('subscriptions', 'read', self.collection.document(spec.after_id).get)
+            if not cursor.exists or cursor.to_dict()['user_id'] != user_id:
+                raise ValueError(f"Cursor document {spec.after_id} not found")
+            query = query.start_after(cursor)
+        if spec.fields is not None:
+            query = query.select(list(spec.fields))
+        return query
+
+    async def list_page(self, user_id: str, spec: ListQuery) -> Tuple[List[dict], Optional[str]]:
+        """One page of `spec`, plus the id to resume after (None on the last page)"""
+        cached = self.cache.get_all(user_id)
+        if cached is not None:
+            page = spec.apply(cached)
+            if page is not None:
+                return page
+        query = await self._query(user_id, spec)
+        if spec.limit:
+            query = query.limit(spec.limit + 1)
+        docs = await firestore_read('subscriptions', 'query', lambda: fetch_all(query))
+        subs = [spec.project({**doc.to_dict(), 'subscription_id': doc.id}) for doc in docs]
+        if spec.limit and len(subs) > spec.limit:
+            return subs[:spec.limit], subs[spec.limit - 1]['subscription_id']
+        return subs, None
+
+    async def stream_for_user(self, user_id: str, spec: ListQuery) -> AsyncIterator[dict]:
+        """Iterator over `spec`'s results as the query stream delivers them, without buffering"""
+        query = await self._query(user_id, spec)
+        if spec.limit:
+            query = query.limit(spec.limit)
+
+        async def results():
+            # Bounded by the consumer, not a call budget or the request deadline: the stream is the response body
+            async with firestore_call('subscriptions', 'query', timeout=None):
+                async for doc in query.stream():
+                    yield spec.project({**doc.to_dict(), 'subscription_id': doc.id})
+        return results()
+
+    async def get(self, subscription_id: str) -> Optional[dict]:
+        sub = await read_flights.do(
+            ('subscriptions.get', subscription_id, self.cache.generation), lambda: self._get(subscription_id)
+        )
+        return None if sub is None else dict(sub)
+
+    async def _get(self, subscription_id: str) -> Optional[dict]:
+        doc = await firestore_read('subscriptions', 'read', self.collection.document(subscription_id).get, hedge=True)
+        return {**doc.to_dict(), 'subscription_id': doc.id} if doc.exists else None
+
+    async def get_for_user(self, subscription_id: str, user_id: str) -> Optional[dict]:
+        """Fetch a subscription owned by `user_id`, from the cache when loaded."""
+        loaded, sub = self.cache.get(user_id, subscription_id)
+        if not loaded:
+            sub = await self.get(subscription_id)
+        return sub if sub and sub['user_id'] == user_id else None
+
+    async def get_monthly_total(self, user_id: str) -> float:
+        return await read_flights.do(
+            ('subscription_totals.get', user_id, self.cache.generation), lambda: self._get_monthly_total(user_id)
+        )
+
+    async def _get_monthly_total(self, user_id: str) -> float:
+        doc = await firestore_read('subscription_totals', 'read', self.totals.document(user_id).get, hedge=True)
+        return doc.to_dict().get('monthly_total', 0.0) if doc.exists else 0.0
+
+    async def renewals_between(self, user_id: str, start: date, end: date) -> List[dict]:
+        """Active subscriptions renewing from `start` to `end` inclusive, soonest first"""
+        low, high = renewal_timestamp(start), renewal_timestamp(end + timedelta(days=1))
+        cached = self.cache.get_all(user_id)
+        if cached is not None:
+            subs = [
+                sub for sub in cached
+                if sub['status'] == Status.active.value and sub.get('renewal_at') is not None and low <= sub['renewal_at'] < high
+            ]
+            return sorted(subs, key=lambda sub: sub['renewal_at'])
+        query = self.collection \
+            .where('user_id', '==', user_id) \
+            .where('status', '==', Status.active.value) \
+            .where('renewal_at', '>=', low) \
+            .where('renewal_at', '<', high) \
+            .order_by('renewal_at')
+        docs = await firestore_read('subscriptions', 'query', lambda: fetch_all(query))
+        return [{**doc.to_dict(), 'subscription_id': doc.id} for doc in docs]
+
+    async def create(self, data: dict) -> str:
+        data = with_renewal_at(data)
+        doc_ref = self.collection.document()
+        batch = self.client.batch()
+        batch.set(doc_ref, data)
+        self._write_totals(batch, [(doc_ref.id, None, None, data)])
+        await self._commit(batch)
+        self.cache.put(data['user_id'], doc_ref.id, data)
+        return doc_ref.id
+
+    async def _conditional_write(
+        self, subscription_id: str, user_id: str, data: Optional[dict], if_match: Optional[str]
+    ) -> Tuple[int, Optional[dict]]:
+        """Update (or delete, when `data` is None) an owned doc with one read and one preconditioned commit"""
+        data = None if data is None else with_renewal_at(data)
+        doc_ref = self.collection.document(subscription_id)
+        for _ in range(CONDITIONAL_WRITE_ATTEMPTS):
+            snapshot = await firestore_read('subscriptions', 'read', doc_ref.get)
+            old = snapshot.to_dict() if snapshot.exists else None
+            if not old or old['user_id'] != user_id:
+                return 404, None
+            if if_match and if_match != '*' and if_match != subscription_version(old):
+                return 412, None
+
+            option = self.client.write_option(last_update_time=snapshot.update_time)
+            merged = None if data is None else {**old, **data}
+            batch = self.client.batch()
+            if data is None:
+                batch.delete(doc_ref, option=option)
+            else:
+                batch.update(doc_ref, data, option=option)
+            self._write_totals(batch, [(subscription_id, snapshot.update_time, old, merged)])
+            try:
+                await self._commit(batch)
+            except FailedPrecondition:
+                if if_match:
+                    return 412, None
+                continue
+
+            if merged is None:
+                self.cache.remove(user_id, subscription_id)
+                return 200, None
+            self.cache.put(user_id, subscription_id, merged)
+            return 200, {**merged, 'subscription_id': subscription_id}
+        return 409, None
+
+    async def update(
+        self, subscription_id: str, user_id: str, data: dict, if_match: Optional[str] = None
+    ) -> Tuple[int, Optional[dict]]:
+        return await self._conditional_write(subscription_id, user_id, data, if_match)
+
+    async def delete(self, subscription_id: str, user_id: str, if_match: Optional[str] = None) -> int:
+        code, _ = await self._conditional_write(subscription_id, user_id, None, if_match)
+        return code
+
+    @staticmethod
+    def _chunks(items: list, size: int = (BATCH_WRITE_LIMIT - 1) // 2):
+        # Each item takes two slots (the doc and its totals marker); one is kept for the owner's totals
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+    async def _owned_snapshots(self, user_id: str, subscription_ids: List[str]) -> Tuple[dict, Dict[str, int]]:
+        """Fetch many docs in one get_all; returns owned snapshots and a status per rejected id."""
+        refs = [self.collection.document(subscription_id) for subscription_id in subscription_ids]
+        snapshots, rejected = {}, {}
+        async with firestore_call('subscriptions', 'read'):
+            async for snapshot in self.client.get_all(refs):
+                if not snapshot.exists or snapshot.to_dict()['user_id'] != user_id:
+                    rejected[snapshot.id] = 404
+                else:
+                    snapshots[snapshot.id] = snapshot
+        for subscription_id in subscription_ids:
+            if subscription_id not in snapshots:
+                rejected.setdefault(subscription_id, 404)
+        return snapshots, rejected
+
+    async def bulk_create(self, user_id: str, items: List[dict]) -> List[Tuple[int, str]]:
+        """Create owned subscriptions in chunked batches; returns (status code, id) per item"""
+        created = []
+        items = [with_renewal_at(data) for data in items]
+        for chunk in self._chunks(items):
+            batch = self.client.batch()
+            refs = [self.collection.document() for _ in chunk]
+            for doc_ref, data in zip(refs, chunk):
+                batch.set(doc_ref, data)
+            self._write_totals(batch, [(doc_ref.id, None, None, data) for doc_ref, data in zip(refs, chunk)])
+            try:
+                await self._commit(batch)
+            except CHUNK_FAILURES as e:
+                created.extend((chunk_failure_code(e), doc_ref.id) for doc_ref in refs)
+                continue
+            for doc_ref, data in zip(refs, chunk):
+                self.cache.put(user_id, doc_ref.id, data)
+            created.extend((201, doc_ref.id) for doc_ref in refs)
+        return created
+
+    async def bulk_update(self, user_id: str, updates: Dict[str, dict]) -> Dict[str, Tuple[int, Optional[dict]]]:
+        """Apply updates to owned docs in chunked batches; returns (status code, document) per id"""
+        results = {}
+        updates = {subscription_id: with_renewal_at(data) for subscription_id, data in updates.items()}
+        for chunk in self._chunks(list(updates)):
+            try:
+                snapshots, rejected = await self._owned_snapshots(user_id, chunk)
+            except CHUNK_FAILURES as e:
+                results.update({subscription_id: (chunk_failure_code(e), None) for subscription_id in chunk})
+                continue
+            results.update({subscription_id: (code, None) for subscription_id, code in rejected.items()})
+            if not snapshots:
+                continue
+            batch, changes, merged = self.client.batch(), [], {}
+            for subscription_id, snapshot in snapshots.items():
+                old = snapshot.to_dict()
+                merged[subscription_id] = {**old, **updates[subscription_id]}
+                changes.append((subscription_id, snapshot.update_time, old, merged[subscription_id]))
+                batch.update(
+                    snapshot.reference,
+                    updates[subscription_id],
+                    option=self.client.write_option(last_update_time=snapshot.update_time)
+                )
+            self._write_totals(batch, changes)
+            try:
+                await self._commit(batch)
+            except FailedPrecondition:
+                results.update({subscription_id: (409, None) for subscription_id in merged})
+                continue
+            except CHUNK_FAILURES as e:
+                results.update({subscription_id: (chunk_failure_code(e), None) for subscription_id in merged})
+                continue
+            for subscription_id, data in merged.items():
+                self.cache.put(user_id, subscription_id, data)
+                results[subscription_id] = (200, {**data, 'subscription_id': subscription_id})
+        return results
+
+    async def bulk_delete(self, user_id: str, subscription_ids: List[str]) -> Dict[str, int]:
+        """Delete owned docs in chunked batches; returns a status code per id"""
+        results = {}
+        for chunk in self._chunks(subscription_ids):
+            try:
+                snapshots, rejected = await self._owned_snapshots(user_id, chunk)
+            except CHUNK_FAILURES as e:
+                results.update({subscription_id: chunk_failure_code(e) for subscription_id in chunk})
+                continue
+            results.update(rejected)
+            if not snapshots:
+                continue
+            batch = self.client.batch()
+            for snapshot in snapshots.values():
+                batch.delete(snapshot.reference, option=self.client.write_option(last_update_time=snapshot.update_time))
+            self._write_totals(batch, [
+                (subscription_id, snapshot.update_time, snapshot.to_dict(), None)
+                for subscription_id, snapshot in snapshots.items()
+            ])
+            try:
+                await self._commit(batch)
+            except FailedPrecondition:
+                results.update({subscription_id: 409 for subscription_id in snapshots})
+                continue
+            except CHUNK_FAILURES as e:
+                results.update({subscription_id: chunk_failure_code(e) for subscription_id in snapshots})
+                continue
+            for subscription_id in snapshots:
+                self.cache.remove(user_id, subscription_id)
+                results[subscription_id] = 200
+        return results
+
+    # Writes that land mid-rebuild can be lost, so run it while traffic is quiet
+    async def rebuild_totals(self, user_id: Optional[str] = None) -> int:
+        """Recompute totals docs from the subscriptions themselves; returns how many were written"""
+        query = self.collection if user_id is None else self.collection.where('user_id', '==', user_id)
+        totals = {}
+        async with firestore_call('subscriptions', 'query', timeout=None):
+            async for doc in query.stream():
+                sub = doc.to_dict()
+                entry = totals.setdefault(sub['user_id'], empty_totals(sub['user_id']))
+                entry['monthly_total'] += monthly_cost(sub)
+                entry['count_by_cycle'][BillingCycle(sub['billing_cycle']).value] += 1
+                entry['count_by_status'][Status(sub['status']).value] += 1
+
+        if user_id is not None:
+            totals.setdefault(user_id, empty_totals(user_id))
+        else:
+            async with firestore_call('subscription_totals', 'query', timeout=None):
+                async for doc in self.totals.select([]).stream():
+                    totals.setdefault(doc.id, empty_totals(doc.id))
+
+        batch, pending = self.client.batch(), 0
+        for uid, entry in totals.items():
+            batch.set(self.totals.document(uid), {**entry, 'updated_at': firestore.SERVER_TIMESTAMP})
+            pending += 1
+            if pending == BATCH_WRITE_LIMIT:
+                await self._commit(batch, 'subscription_totals')
+                batch, pending = self.client.batch(), 0
+        if pending:
+            await self._commit(batch, 'subscription_totals')
+        return len(totals)
+
+    async def chunks_by_user(self, size: int) -> AsyncIterator[List[dict]]:
+        """Yield the whole collection in pages of `size`, ordered by owner"""
+        query = self.collection.select(ANALYTICS_FIELDS).order_by('user_id').limit(size)
+        last = None
+        while True:
+            page = query.start_after(last) if last is not None else query
+            async with firestore_call('subscriptions', 'query', timeout=None):
+                snapshots = [doc async for doc in page.stream()]
+            if not snapshots:
+                return
+            yield [doc.to_dict() for doc in snapshots]
+            if len(snapshots) < size:
+                return
+            last = snapshots[-1]
+
+    async def backfill_renewal_at(self) -> Tuple[int, int]:
+        """Add `renewal_at` to documents written before it existed; returns (updated, undated)"""
+        batch, pending, updated, undated = self.client.batch(), 0, 0, 0
+        owners = set()
+
+        async def flush_if_full():
+            nonlocal batch, pending
+            if pending == BATCH_WRITE_LIMIT:
+                await self._commit(batch)
+                batch, pending = self.client.batch(), 0
+
+        async with firestore_call('subscriptions', 'query', timeout=None):
+            async for doc in self.collection.stream():
+                sub = doc.to_dict()
+                if 'renewal_at' in sub:
+                    continue
+                # Legacy dashboard writes may hold a Timestamp, null or nothing here
+                value = sub.get('next_renewal_date')
+                try:
+                    day = renewal_date(value) if isinstance(value, str) else None
+                except ValueError:
+                    day = None
+                # Null rather than absent, so sorting by renewal date still lists the doc
+                if day is None:
+                    undated += 1
+                batch.update(doc.reference, {'renewal_at': None if day is None else renewal_timestamp(day)})
+                owners.add(sub['user_id'])
+                updated += 1
+                pending += 1
+                await flush_if_full()
+        for uid in owners:
+            batch.set(self.totals.document(uid), {'updated_at': firestore.SERVER_TIMESTAMP}, merge=True)
+            pending += 1
+            await flush_if_full()
+        if pending:
+            await self._commit(batch)
+        return updated, undated
+
+user_repo = UserRepository(get_db)
+subscription_repo = SubscriptionRepository(get_db, subscription_cache)
+
+# Email outbox
+# Workers claim due messages with a lease written under an update-time
+# precondition, so several can share the outbox. Delivered messages are
+# deleted; failed ones get an `expire_at` for the collection's TTL policy.
+class EmailOutbox:
+    """Durable queue of outbound emails in the `email_outbox` collection, drained by run()"""
+
+    def __init__(self, client_factory):
+        self._client_factory = client_factory
+        self._wake = asyncio.Event()
+        self._sending = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+
+    @property
+    def client(self):
+        return self._client_factory()
+
+    @property
+    def collection(self):
+        return self.client.collection('email_outbox')
+
+    async def enqueue(self, kind: str, payload: dict) -> None:
+        now = datetime.now(timezone.utc)
+        async with firestore_call('email_outbox', 'write'):
+            await self.collection.document().set({
+                'kind': kind,
+                'payload': payload,
+                'status': 'pending',
+                'attempts': 0,
+                'next_attempt_at': now,
+                'created_at': now,
+                'last_error': None,
+            })
+        self._wake.set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                claimed = await self.drain_once()
+            except Exception as e:
+                print(f"Email outbox poll failed: {e}")
+                claimed = 0
+            if claimed:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        """Process one batch of due messages; returns how many this worker claimed"""
+        query = self.collection \
+            .where('status', '==', 'pending') \
+            .where('next_attempt_at', '<=', datetime.now(timezone.utc)) \
+            .order_by('next_attempt_at') \
+            .limit(OUTBOX_BATCH_SIZE)
+        async with firestore_call('email_outbox', 'query'):
+            snapshots = [snapshot async for snapshot in query.stream()]
+        claimed = await asyncio.gather(*(self._process(snapshot) for snapshot in snapshots))
+        return sum(claimed)
+
+    async def _process(self, snapshot) -> bool:
+        message = snapshot.to_dict()
+        attempts = message['attempts'] + 1
+        lease_until = datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        try:
+            async with firestore_call('email_outbox', 'write'):
+                await snapshot.reference.update(
+                    {'attempts': attempts, 'next_attempt_at': lease_until},
+                    option=self.client.write_option(last_update_time=snapshot.update_time)
+                )
+        except (FailedPrecondition, NotFound):
+            return False  # Another worker got there first
+
+        async with self._sending:
+            try:
+                await self._send(message['kind'], message['payload'])
+            except Exception as e:
+                await self._reschedule(snapshot.reference, attempts, e)
+                return True
+        async with firestore_call('email_outbox', 'write'):
+            await snapshot.reference.delete()
+        return True
+
+    async def _reschedule(self, doc_ref, attempts: int, error: Exception) -> None:
+        permanent = isinstance(error, httpx.HTTPStatusError) \
+            and 400 <= error.response.status_code < 500 \
+            and error.response.status_code != 429
+        if isinstance(error, CircuitOpenError):
+            # Never sent, so the attempt is given back and the message waits out the breaker
+            update = {
+                'attempts': attempts - 1,
+                'next_attempt_at': datetime.now(timezone.utc) + timedelta(seconds=error.retry_after),
+                'last_error': str(error),
+            }
+        elif permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+            update = {
+                'status': 'failed',
+                'last_error': str(error),
+                'expire_at': datetime.now(timezone.utc) + timedelta(days=OUTBOX_FAILED_RETENTION_DAYS),
+            }
+        else:
+            delay = min(OUTBOX_BACKOFF_CAP_SECONDS, OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1))
+            delay *= random.uniform(0.5, 1.5)
+            update = {
+                'next_attempt_at': datetime.now(timezone.utc) + timedelta(seconds=delay),
+                'last_error': str(error),
+            }
+        async with firestore_call('email_outbox', 'write'):
+            await doc_ref.update(update)
+
+    async def _send(self, kind: str, payload: dict) -> None:
+        if kind == 'verify_email':
+            # sendOobCode needs an ID token, so exchange a custom token for one first
+            sign_in = await identity_toolkit_post("signInWithCustomToken", {
+                "token": create_custom_token(payload['uid']),
+                "returnSecureToken": True
+            })
+            sign_in.raise_for_status()
+            body = {"requestType": "VERIFY_EMAIL", "idToken": sign_in.json()["idToken"]}
+        elif kind == 'password_reset':
+            body = {"requestType": "PASSWORD_RESET", "email": payload['email']}
+        else:
+            raise ValueError(f"Unknown outbox message kind: {kind}")
+        response = await identity_toolkit_post("sendOobCode", body)
+        response.raise_for_status()
+
+email_outbox = EmailOutbox(get_db)
+
+# Renewal scheduler
+# Same contract as processRenewals in functions/: reminders get deterministic
+# ids and rolls are preconditioned on the update time, so either can run
+# alongside the other (or a restarted copy of itself) without repeating work.
+class RenewalScheduler:
+    """Rolls renewal dates forward and queues reminders from a min-heap of due events"""
+
+    def __init__(self, client_factory, cache: SubscriptionCache):
+        self._client_factory = client_factory
+        self.cache = cache
+        self._heap = []
+        self._queued = set()
+        self._next_refill = None
+
+    @property
+    def client(self):
+        return self._client_factory()
+
+    @property
+    def collection(self):
+        return self.client.collection('subscriptions')
+
+    @property
+    def reminders(self):
+        return self.client.collection('renewal_reminders')
+
+    def _push(self, subscription_id: str, renewal_at: datetime) -> int:
+        pushed = 0
+        for due_at, action in ((renewal_at - timedelta(days=RENEWAL_REMINDER_DAYS), 'remind'), (renewal_at, 'roll')):
+            key = (subscription_id, action, renewal_at)
+            if key not in self._queued:
+                self._queued.add(key)
+                heapq.heappush(self._heap, (due_at, subscription_id, action, renewal_at))
+                pushed += 1
+        return pushed
+
+    async def refill(self, now: datetime) -> int:
+        """Load the renewals due before the next refill; returns how many events were queued"""
+        self._next_refill = now + timedelta(seconds=RENEWAL_REFILL_SECONDS)
+        horizon = self._next_refill + timedelta(days=RENEWAL_REMINDER_DAYS)
+        # Past renewals are either rolled already or are retried by this refill
+        self._queued = {key for key in self._queued if key[2] > now}
+        query = self.collection \
+            .where('status', '==', Status.active.value) \
+            .where('renewal_at', '<', horizon) \
+            .order_by('renewal_at')
+        pushed = 0
+        async with firestore_call('subscriptions', 'query', timeout=None):
+            async for doc in query.stream():
+                pushed += self._push(doc.id, doc.to_dict()['renewal_at'])
+        return pushed
+
+    async def process_due(self, now: datetime) -> int:
+        """Run every event due by `now`; returns how many were run"""
+        processed = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, subscription_id, action, renewal_at = heapq.heappop(self._heap)
+            if action == 'remind' and renewal_at <= now:
+                continue  # Too late to remind; the roll follows
+            try:
+                if action == 'remind':
+                    await self._remind(subscription_id, renewal_at)
+                else:
+                    await self._roll(subscription_id, renewal_at, now)
+            except Exception as e:
+                print(f"Renewal {action} for {subscription_id} failed: {e}")
+            processed += 1
+        return processed
+
+    async def run_once(self) -> int:
+        now = datetime.now(timezone.utc)
+        await self.refill(now)
+        return await self.process_due(now)
+
+    async def run(self) -> None:
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                if self._next_refill is None or now >= self._next_refill:
+                    await self.refill(now)
+                await self.process_due(now)
+            except Exception as e:
+                print(f"Renewal scheduler pass failed: {e}")
+                self._next_refill = None
+            wake_at = self._next_refill or now + timedelta(seconds=RENEWAL_REFILL_SECONDS)
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            await asyncio.sleep(max(1.0, (wake_at - datetime.now(timezone.utc)).total_seconds()))
+
+    async def _current(self, subscription_id: str, renewal_at: datetime):
+        """The subscription's snapshot, or None if it is no longer active at this renewal"""
+        snapshot = await firestore_read('subscriptions', 'read', self.collection.document(subscription_id).get)
+        sub = snapshot.to_dict() if snapshot.exists else None
+        if not sub or sub['status'] != Status.active.value or sub.get('renewal_at') != renewal_at:
+            return None
+        return snapshot
+
+    async def _remind(self, subscription_id: str, renewal_at: datetime) -> None:
+        snapshot = await self._current(subscription_id, renewal_at)
+        if snapshot is None:
+            return
+        sub = snapshot.to_dict()
+        reminder_id = f"{subscription_id}_{renewal_at.date().isoformat()}"
+        try:
+            async with firestore_call('renewal_reminders', 'write'):
+                await self.reminders.document(reminder_id).create({
+                    'user_id': sub['user_id'],
+                    'subscription_id': subscription_id,
+                    'service_name': sub['service_name'],
+                    'cost': sub['cost'],
+                    'renewal_at': renewal_at,
+                    'status': 'pending',
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                })
+        except AlreadyExists:
+            pass
+
+    async def _roll(self, subscription_id: str, renewal_at: datetime, now: datetime) -> None:
+        snapshot = await self._current(subscription_id, renewal_at)
+        if snapshot is None:
+            return
+        sub = snapshot.to_dict()
+        next_date = roll_renewal_date(renewal_date(sub['next_renewal_date']), sub['billing_cycle'], now.date())
+        update = {
+            'next_renewal_date': next_date.isoformat(),
+            'renewal_at': renewal_timestamp(next_date),
+            'updated_at': datetime.now(),
+        }
+        batch = self.client.batch()
+        batch.update(snapshot.reference, update, option=self.client.write_option(last_update_time=snapshot.update_time))
+        # Bump the owner's collection version so conditional list reads see the change
+        batch.set(
+            self.client.collection('subscription_totals').document(sub['user_id']),
+            {'updated_at': firestore.SERVER_TIMESTAMP},
+            merge=True
+        )
+        try:
+            async with firestore_call('subscriptions', 'commit'):
+                await batch.commit()
+        except (FailedPrecondition, NotFound):
+            return  # Changed since the read; the next refill sees the new state
+        self.cache.put(sub['user_id'], subscription_id, {**sub, **update})
+        if update['renewal_at'] < self._next_refill + timedelta(days=RENEWAL_REMINDER_DAYS):
+            self._push(subscription_id, update['renewal_at'])
+
+renewal_scheduler = RenewalScheduler(get_db, subscription_cache)
+
+# Change feed
+class UserFeed:
+    """One user's snapshot listener, its current documents and the sessions it feeds"""
+
+    def __init__(self):
+        self.sessions = set()
+        self.docs = {}
+        self.ready = False
+        self.watch = None
+
+# A session that falls CHANGE_FEED_QUEUE_SIZE events behind has its backlog
+# replaced by a fresh snapshot, so a slow client costs bounded memory.
+class ChangeFeed:
+    """Fans one Firestore on_snapshot listener per user out to that user's sessions"""
+
+    def __init__(self, client_factory):
+        self._client_factory = client_factory
+        self._feeds: Dict[str, UserFeed] = {}
+        self.session_count = 0
+
+    def check(self, user_id: str) -> None:
+        if self.session_count >= CHANGE_FEED_MAX_SESSIONS:
+            raise HTTPException(status_code=503, detail="Too many open change feeds", headers={"Retry-After": "30"})
+        feed = self._feeds.get(user_id)
+        if feed and len(feed.sessions) >= CHANGE_FEED_MAX_PER_USER:
+            raise HTTPException(status_code=429, detail=f"At most {CHANGE_FEED_MAX_PER_USER} change feeds per user")
+
+    def open(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(CHANGE_FEED_QUEUE_SIZE)
+        feed = self._feeds.get(user_id)
+        if feed is None:
+            feed = self._feeds[user_id] = UserFeed()
+            feed.watch = self._listen(user_id)
+            CHANGE_FEED_LISTENERS.inc()
+        feed.sessions.add(queue)
+        self.session_count += 1
+        CHANGE_FEED_SESSIONS.inc()
+        if feed.ready:
+            self._offer(feed, queue, self._snapshot(feed))
+        return queue
+
+    def close(self, user_id: str, queue: asyncio.Queue) -> None:
+        feed = self._feeds.get(user_id)
+        if feed is None or queue not in feed.sessions:
+            return
+        feed.sessions.discard(queue)
+        self.session_count -= 1
+        CHANGE_FEED_SESSIONS.dec()
+        if not feed.sessions:
+            del self._feeds[user_id]
+            self._stop(feed)
+
+    def close_all(self) -> None:
+        for feed in self._feeds.values():
+            CHANGE_FEED_SESSIONS.dec(len(feed.sessions))
+            self._stop(feed)
+        self._feeds.clear()
+        self.session_count = 0
+
+    def _stop(self, feed: UserFeed) -> None:
+        CHANGE_FEED_LISTENERS.dec()
+        # unsubscribe() joins the listener thread, so keep it off the event loop
+        asyncio.get_running_loop().run_in_executor(None, feed.watch.unsubscribe)
+
+    def _listen(self, user_id: str):
+        loop = asyncio.get_running_loop()
+
+        def on_snapshot(docs, changes, read_time):
+            # Runs on the listener's thread; hand plain data over to the loop
+            events = [(change.type.name, change.document.id, change.document.to_dict()) for change in changes]
+            loop.call_soon_threadsafe(self._dispatch, user_id, events)
+
+        query = self._client_factory().collection('subscriptions').where('user_id', '==', user_id)
+        return query.on_snapshot(on_snapshot)
+
+    def _dispatch(self, user_id: str, changes: list) -> None:
+        feed = self._feeds.get(user_id)
+        if feed is None:
+            return  # Closed while the callback was in flight
+        events = []
+        for kind, doc_id, data in changes:
+            if kind == 'REMOVED':
+                feed.docs.pop(doc_id, None)
+                events.append(('removed', {'subscription_id': doc_id}))
+            else:
+                sub = {**data, 'subscription_id': doc_id}
+                feed.docs[doc_id] = sub
+                events.append((kind.lower(), sub))
+        if not feed.ready:
+            # The first callback carries the initial result set
+            feed.ready = True
+            events = [self._snapshot(feed)]
+        for queue in feed.sessions:
+            for event in events:
+                self._offer(feed, queue, event)
+
+    @staticmethod
+    def _snapshot(feed: UserFeed) -> Tuple[str, list]:
+        return 'snapshot', list(feed.docs.values())
+
+    def _offer(self, feed: UserFeed, queue: asyncio.Queue, event: Tuple[str, object]) -> None:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The snapshot already reflects every queued delta
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(self._snapshot(feed))
+            CHANGE_FEED_RESYNCS.inc()
+
+change_feed = ChangeFeed(get_sync_db)
 
 # Helper functions
+def load_analytics():
+    return importlib.import_module(ANALYTICS_MODULE)
+
+async def fleet_analytics(chunk_size: int = ANALYTICS_CHUNK_SIZE) -> dict:
+    """Aggregate the whole collection one chunk at a time (see analytics.FleetAggregate)"""
+    analytics = load_analytics()
+    aggregate = analytics.FleetAggregate(datetime.now(timezone.utc).date())
+    async for chunk in subscription_repo.chunks_by_user(chunk_size):
+        aggregate.add(analytics.Columns.from_subscriptions(chunk))
+    return aggregate.result()
+
 def create_custom_token(uid: str) -> str:
     """Create a custom Firebase token for the user"""
     return auth.create_custom_token(uid).decode('utf-8')
@@ -118,6 +1904,81 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None)
     to_encode.update({"exp": expire, "type": "refresh"})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def encode_cursor(subscription_id: str) -> str:
+    return base64.urlsafe_b64encode(subscription_id.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        subscription_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except ValueError:
+        subscription_id = ""
+    if not subscription_id or "/" in subscription_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return subscription_id
+
+def json_default(value):
+    """orjson fallback: Firestore's DatetimeWithNanoseconds and other datetime subclasses"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dump_json(content) -> bytes:
+    return orjson.dumps(content, default=json_default)
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson, skipping FastAPI's jsonable_encoder walk"""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+async def change_events(user_id: str) -> AsyncIterator[bytes]:
+    """Server-Sent Events for one change feed session, with comment heartbeats"""
+    # Opened here rather than in the endpoint so the session is closed by
+    # this generator's finally even if the client leaves before streaming
+    queue = change_feed.open(user_id)
+    try:
+        yield b"retry: 5000\n\n"
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), CHANGE_FEED_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+            yield b"event: " + event.encode() + b"\ndata: " + dump_json(data) + b"\n\n"
+    finally:
+        change_feed.close(user_id, queue)
+
+def parse_fields(fields: str) -> Tuple[str, ...]:
+    requested = tuple(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    unknown = [field for field in requested if field not in LIST_FIELDS and field != 'subscription_id']
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return tuple(field for field in requested if field != 'subscription_id')
+
+async def ndjson_lines(items: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    async for item in items:
+        yield dump_json(item) + b"\n"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires: W/ prefixes are ignored and * matches"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or any(tag.removeprefix('W/') == etag for tag in candidates)
+
+def as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def modified_since(if_modified_since: Optional[str], last_modified: datetime) -> bool:
+    """False only for a valid If-Modified-Since at or after `last_modified` (to the second)"""
+    if not if_modified_since:
+        return True
+    try:
+        since = as_utc(parsedate_to_datetime(if_modified_since))
+    except (TypeError, ValueError):
+        return True
+    return as_utc(last_modified).replace(microsecond=0) > since
+
 def set_auth_cookies(response: Response, access_token: str, refresh_token: str, expires: timedelta) -> None:
     secure = os.getenv("ENVIRONMENT") == "production"
     cookie_prefix = "__Host-" if secure else ""
@@ -171,22 +2032,75 @@ async def get_current_user(token: str = Cookie(None)) -> dict:
         )
 
 async def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    claims = token_cache.get(credentials.credentials)
+    if claims is not None:
+        return claims
     try:
-        return auth.verify_id_token(credentials.credentials)
+        claims = await auth_admin("verify_id_token", auth.verify_id_token, credentials.credentials, retry=True)
+    except DEPENDENCY_FAILURES:
+        raise
     except Exception:
         raise HTTPException(status_code=401, detail="Authentication failed")
+    token_cache.put(credentials.credentials, claims)
+    return claims
+
+user_record_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+async def get_user_record(uid: str) -> auth.UserRecord:
+    """auth.get_user, served from a short-lived per-worker cache"""
+    user = user_record_cache.get(uid)
+    if user is None:
+        user = await auth_admin("get_user", auth.get_user, uid, retry=True)
+        user_record_cache[uid] = user
+    return user
 
-def get_user_data(user_id: str) -> Optional[dict]:
-    user_doc = db.collection('users').document(user_id).get()
-    return user_doc.to_dict() if user_doc.exists else None
+async def get_user_data(user_id: str) -> Optional[dict]:
+    return await user_repo.get(user_id)
 
-def verify_firebase_password(email: str, password: str) -> dict:
-    auth_url = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
+identity_toolkit_breaker = CircuitBreaker("identity_toolkit", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+
+# Not retried: sign-ups and emails are not idempotent. Timeouts, transport
+# errors, 429s and 5xx count as breaker failures; other answers mean it is up.
+async def identity_toolkit_post(method: str, payload: dict) -> httpx.Response:
+    """POST to Identity Toolkit `accounts:<method>` over the shared pooled client, behind the circuit breaker"""
+    identity_toolkit_breaker.check()
+    read_timeout = call_timeout("identity_toolkit", HTTP_READ_TIMEOUT)
+    try:
+        with auth_call(method):
+            response = await app.state.http_client.post(
+                f"/accounts:{method}",
+                params={"key": FIREBASE_API_KEY},
+                json=payload,
+                timeout=httpx.Timeout(read_timeout, connect=min(HTTP_CONNECT_TIMEOUT, read_timeout)),
+            )
+    except httpx.TimeoutException as e:
+        identity_toolkit_breaker.record_failure()
+        raise dependency_timed_out("identity_toolkit") from e
+    except httpx.TransportError as e:
+        identity_toolkit_breaker.record_failure()
+        raise DependencyUnavailable("identity_toolkit", type(e).__name__) from e
+    if response.status_code == 429 or response.status_code >= 500:
+        identity_toolkit_breaker.record_failure()
+        raise DependencyUnavailable("identity_toolkit", f"HTTP {response.status_code}")
+    identity_toolkit_breaker.record_success()
+    return response
+
+class InvalidCredentials(Exception):
+    """Identity Toolkit rejected the email / password pair itself"""
+
+# signInWithPassword errors that mean a wrong guess; INVALID_LOGIN_CREDENTIALS
+# replaces both when email enumeration protection is on
+CREDENTIAL_ERRORS = {"INVALID_PASSWORD", "EMAIL_NOT_FOUND", "INVALID_LOGIN_CREDENTIALS"}
+
+async def verify_firebase_password(email: str, password: str) -> dict:
     payload = {"email": email, "password": password, "returnSecureToken": True}
-    response = requests.post(f"{auth_url}?key={FIREBASE_API_KEY}", json=payload)
+    response = await identity_toolkit_post("signInWithPassword", payload)
     
-    if not response.ok:
+    if not response.is_success:
+        # Messages look like "INVALID_PASSWORD" or "TOO_MANY_ATTEMPTS_TRY_LATER : ..."
         error_data = response.json()
+        if error_data.get("error", {}).get("message", "").split(" ")[0] in CREDENTIAL_ERRORS:
+            raise InvalidCredentials()
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return response.json()
 
@@ -252,7 +2166,7 @@ class Status(str, Enum):
     active = "Active"
     cancelled = "Cancelled"
 
-class Subscription(BaseModel):
+class SubscriptionBase(BaseModel):
     service_name: str
     cost: float
     billing_cycle: BillingCycle
@@ -260,32 +2174,92 @@ class Subscription(BaseModel):
     status: Status
     user_id: str
 
-class SubscriptionResponse(Subscription):
+class Subscription(SubscriptionBase):
+    """A subscription as clients send it; only well-formed renewal dates are accepted"""
+
+    @field_validator('next_renewal_date')
+    @classmethod
+    def check_renewal_date(cls, value: str) -> str:
+        renewal_date(value)
+        return value
+
+class SubscriptionResponse(SubscriptionBase):
+    """A subscription as stored, which may predate date validation (see backfill-renewals)"""
     subscription_id: str
     created_at: datetime
     updated_at: datetime
 
+class BulkSubscriptionUpdate(Subscription):
+    subscription_id: str
+
+class BulkDeleteRequest(BaseModel):
+    subscription_ids: List[str]
+
+class BulkItemResult(BaseModel):
+    index: int
+    status_code: int
+    subscription_id: Optional[str] = None
+    detail: Optional[str] = None
+    subscription: Optional[SubscriptionResponse] = None
+
+# Serialization
+# Endpoints that declare these models return bytes from the prebuilt adapters
+# instead of going through response_model validation plus jsonable_encoder;
+# response_model stays on the route for the OpenAPI schema.
+# See benchmarks/bench_serialization.py.
+subscription_adapter = TypeAdapter(SubscriptionResponse)
+bulk_results_adapter = TypeAdapter(List[BulkItemResult])
+
+def subscription_json(sub: dict) -> Response:
+    """Validate and serialize one subscription in a single pass, with its ETag"""
+    body = subscription_adapter.dump_json(subscription_adapter.validate_python(sub))
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": subscription_version(sub)},
+    )
+
+def bulk_results_json(results: List[BulkItemResult]) -> Response:
+    return Response(content=bulk_results_adapter.dump_json(results), media_type="application/json")
+
+# Operational endpoints
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready", include_in_schema=False)
+def ready():
+    # Only reachable once lifespan startup, including any warm-up, has finished
+    return {"status": "ready"}
+
 # Authentication endpoints
 @app.get("/")
 def read_root():
     return {"message": "SubTrack API - User Authentication Service"}
 
-@app.post("/auth/login")
-@limiter.limit("5/minute")
+@app.post("/auth/login", dependencies=[rate_limit("login")])
 async def login(
     request: Request,
     user_data: UserLogin, 
     response: Response
 ):
+    # Only failed attempts (guesses) count against the account; successful sign-ins never use it up
+    account = user_data.email.lower()
+    await request.app.state.rate_limiter.check("login-account", account, cost=0)
     try:
-        auth_result = verify_firebase_password(user_data.email, user_data.password)
-        user = auth.get_user_by_email(user_data.email)
+        auth_result = await verify_firebase_password(user_data.email, user_data.password)
+        # The sign-in response already identifies the account
+        uid = auth_result["localId"]
 
         access_token = create_access_token(
-            data={"sub": user.uid, "email": user_data.email, "scope": "user"}
+            data={"sub": uid, "email": user_data.email, "scope": "user"}
         )
         refresh_token = create_refresh_token(
-            data={"sub": user.uid}
+            data={"sub": uid}
         )
         
         set_auth_cookies(response, access_token, refresh_token, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -294,6 +2268,11 @@ async def login(
             refresh_token=refresh_token
         )
     
+    except DEPENDENCY_FAILURES:
+        raise
+    except InvalidCredentials:
+        await request.app.state.rate_limiter.charge("login-account", account)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     except Exception:
         # Generic error message to prevent information leakage
         raise HTTPException(
@@ -301,7 +2280,7 @@ async def login(
             detail="Invalid credentials"
         )
     
-@app.post("/auth/refresh")
+@app.post("/auth/refresh", dependencies=[rate_limit("refresh")])
 async def refresh_token(
     request: Request,
     response: Response,
@@ -322,7 +2301,7 @@ async def refresh_token(
             )
         
         # Get user data
-        user = auth.get_user(payload["sub"])
+        user = await get_user_record(payload["sub"])
         
         # Create new tokens
         access_token = create_access_token(
@@ -343,6 +2322,8 @@ async def refresh_token(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Refresh token expired"
         )
+    except DEPENDENCY_FAILURES:
+        raise
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -352,10 +2333,10 @@ async def refresh_token(
 @app.post("/auth/google")
 async def google_login(request: GoogleLoginRequest, response: Response):
     try:
-        decoded_token = auth.verify_id_token(request.token)
+        decoded_token = await auth_admin("verify_id_token", auth.verify_id_token, request.token, retry=True)
         uid = decoded_token['uid']
         
-        if not get_user_data(uid):
+        if not await user_repo.exists(uid):
             user_data = {
                 'uid': uid,
                 'email': decoded_token.get('email'),
@@ -363,7 +2344,7 @@ async def google_login(request: GoogleLoginRequest, response: Response):
                 'photo_url': decoded_token.get('picture'),
                 'created_at': datetime.utcnow().isoformat()
             }
-            db.collection('users').document(uid).set(user_data)
+            await user_repo.create(uid, user_data)
         
         expires = timedelta(days=30)
         access_token = create_access_token(
@@ -374,10 +2355,12 @@ async def google_login(request: GoogleLoginRequest, response: Response):
         
         return {"access_token": access_token, "token_type": "bearer", "user_id": uid}
     
+    except DEPENDENCY_FAILURES:
+        raise
     except Exception:
         raise HTTPException(status_code=401, detail="Authentication failed")
 
-@app.post("/auth/register")
+@app.post("/auth/register", dependencies=[rate_limit("register")])
 async def signup(user_data: UserCreate, request: Request):
     try:
         # Validate password
@@ -386,44 +2369,27 @@ async def signup(user_data: UserCreate, request: Request):
             raise HTTPException(status_code=400, detail=message)
         
         # Create the user in Firebase Authentication
-        user = auth.create_user(
+        user = await auth_admin(
+            "create_user",
+            auth.create_user,
             email=user_data.email,
             password=user_data.password,
             email_verified=False
         )
         
         # Store user info in Firestore
-        db.collection('users').document(user.uid).set({
+        await user_repo.create(user.uid, {
             'uid': user.uid, 
             'email': user_data.email,
             'email_verified': False,
             'created_at': datetime.utcnow().isoformat()
         })
 
-        # Generate verification link
-        verification_link = auth.generate_email_verification_link(
-            user_data.email,
-            action_code_settings=auth.ActionCodeSettings(
-                url=f"{request.base_url}dashboard",
-                handle_code_in_app=True
-            )
-        )
-        
-        # Send email via Firebase Authentication REST API
-        # Note: Firebase Admin SDK doesn't directly send emails, 
-        # you need to use the Auth REST API or a third-party email service
-        auth_url = f"https://identitytoolkit.googleapis.com/v1/accounts:sendOobCode?key={FIREBASE_API_KEY}"
-        response = requests.post(auth_url, json={
-            "requestType": "VERIFY_EMAIL",
-            "idToken": create_custom_token(user.uid)  # You'll need to get a token for the user
-        })
-        
-        if not response.ok:
-            # Log the error but don't fail registration
-            print(f"Error sending verification email: {response.text}")
+        # The verification email is sent by the outbox worker, off the request path
+        await email_outbox.enqueue("verify_email", {"uid": user.uid, "email": user_data.email})
         
         return {
-            "message": "User registered successfully. Verification email sent.",
+            "message": "User registered successfully. Verification email queued.",
             "user_id": user.uid,
             "email_verified": False
         }
@@ -433,6 +2399,8 @@ async def signup(user_data: UserCreate, request: Request):
             status_code=400,
             detail="Email already exists. Please use a different email or login."
         )
+    except DEPENDENCY_FAILURES:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=400,
@@ -468,53 +2436,231 @@ async def send_verification_email(
 ):
     try:
         # Get the Firebase user
-        user = auth.get_user(current_user["sub"])
+        user = await get_user_record(current_user["sub"])
         
         # Generate the email verification link
         action_code_settings = auth.ActionCodeSettings(
             url=f"{request.base_url}dashboard",  # Redirect after verification
             handle_code_in_app=True
         )
-        link = auth.generate_email_verification_link(
+        link = await auth_admin(
+            "generate_email_verification_link",
+            auth.generate_email_verification_link,
             user.email,
             action_code_settings=action_code_settings
         )
         
         return {"verification_link": link}
         
+    except DEPENDENCY_FAILURES:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/auth/forgot-password")
-async def forgot_password(request: ForgotPasswordRequest):
+@app.post("/auth/forgot-password", dependencies=[rate_limit("forgot-password")])
+async def forgot_password(request: ForgotPasswordRequest, http_request: Request):
+    await http_request.app.state.rate_limiter.check("forgot-password-account", request.email.lower())
     try:
-        url = f"https://identitytoolkit.googleapis.com/v1/accounts:sendOobCode?key={FIREBASE_API_KEY}"
-        response = requests.post(url, json={
-            "requestType": "PASSWORD_RESET",
-            "email": request.email
-        })
-        
-        return {"message": "If the email exists, a reset link has been sent"}
+        await email_outbox.enqueue("password_reset", {"email": request.email})
+        return {"message": "If the email exists, a reset link will be sent shortly"}
+    except DEPENDENCY_FAILURES:
+        raise
     except Exception:
         raise HTTPException(status_code=500, detail="Request failed")
 
 # Subscription endpoints
 @app.get("/api/subscriptions")
-async def get_subscriptions(decoded_token: dict = Depends(verify_firebase_token)):
-    subscriptions = []
-    docs = db.collection('subscriptions').where('user_id', '==', decoded_token['uid']).stream()
-    for doc in docs:
-        sub = doc.to_dict()
-        sub['subscription_id'] = doc.id
-        subscriptions.append(sub)
-    return subscriptions
+async def get_subscriptions(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    status: Optional[Status] = None,
+    billing_cycle: Optional[BillingCycle] = None,
+    sort: Optional[str] = Query(None, pattern=f"^-?({'|'.join(SORT_FIELDS)})$"),
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    decoded_token: dict = Depends(verify_firebase_token)
+):
+    """List the caller's subscriptions: filtered, sorted, projected, paged or streamed as NDJSON"""
+    uid = decoded_token['uid']
+    after_id = decode_cursor(cursor) if cursor else None
+    spec = ListQuery(
+        status=status.value if status else None,
+        billing_cycle=billing_cycle.value if billing_cycle else None,
+        order_field=SORT_FIELDS[sort.lstrip('-')] if sort else None,
+        descending=bool(sort) and sort.startswith('-'),
+        fields=parse_fields(fields) if fields is not None else None,
+        limit=limit or (DEFAULT_PAGE_SIZE if after_id else None),
+        after_id=after_id,
+    )
+    if stream:
+        try:
+            results = await subscription_repo.stream_for_user(uid, spec)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return StreamingResponse(ndjson_lines(results), media_type="application/x-ndjson")
+    if spec == ListQuery():
+        subs, version = await subscription_repo.list_with_version(uid)
+        if version is None:
+            return FastJSONResponse(subs)
+        headers = {
+            "ETag": version_tag(version),
+            "Last-Modified": format_datetime(as_utc(version), usegmt=True),
+            "Cache-Control": "private, no-cache",
+        }
+        if etag_matches(if_none_match, headers["ETag"]) \
+                or (if_none_match is None and not modified_since(if_modified_since, version)):
+            return Response(status_code=304, headers=headers)
+        return FastJSONResponse(subs, headers=headers)
+
+    try:
+        subs, next_id = await subscription_repo.list_page(uid, spec)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = {"X-Next-Cursor": encode_cursor(next_id)} if next_id else None
+    return FastJSONResponse(subs, headers=headers)
+
+@app.get("/api/subscriptions/renewals")
+async def get_upcoming_renewals(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    decoded_token: dict = Depends(verify_firebase_token)
+):
+    """Active subscriptions renewing between `start` and `end` inclusive, soonest first"""
+    start = start or datetime.now(timezone.utc).date()
+    end = end or start + timedelta(days=DEFAULT_RENEWAL_WINDOW_DAYS)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    if (end - start).days > MAX_RENEWAL_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_RENEWAL_WINDOW_DAYS} days per query")
+    return FastJSONResponse(await subscription_repo.renewals_between(decoded_token['uid'], start, end))
+
+@app.get("/api/subscriptions/changes")
+async def subscription_changes(decoded_token: dict = Depends(verify_firebase_token)):
+    """Live changes to the caller's subscriptions as Server-Sent Events"""
+    uid = decoded_token['uid']
+    change_feed.check(uid)
+    return StreamingResponse(
+        change_events(uid),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/subscriptions/analytics")
+async def get_spending_analytics(decoded_token: dict = Depends(verify_firebase_token)):
+    """Spend by service, billing cycle and status, plus a 12-month projection"""
+    # Imported on first use: NumPy would otherwise load on every cold start
+    analytics = load_analytics()
+    subs = await subscription_repo.list_for_user(decoded_token['uid'])
+    return analytics.user_summary(subs, datetime.now(timezone.utc).date())
+
+BULK_DETAILS = {
+    403: "Access denied",
+    404: "Resource not found",
+    409: "Modified concurrently, retry",
+    503: "Write failed, retry",
+    504: "Write timed out and may have been applied; re-read before retrying",
+}
+
+def check_bulk_size(items: list) -> None:
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+
+def check_unique_ids(subscription_ids: List[str]) -> None:
+    if len(set(subscription_ids)) != len(subscription_ids):
+        raise HTTPException(status_code=400, detail="Duplicate subscription_id in request")
+
+@app.post("/api/subscriptions/bulk", response_model=List[BulkItemResult])
+async def bulk_create_subscriptions(
+    subscriptions: List[Subscription],
+    decoded_token: dict = Depends(verify_firebase_token)
+):
+    check_bulk_size(subscriptions)
+    uid = decoded_token['uid']
+    now = datetime.now()
+    results, accepted = [], []
+    for index, subscription in enumerate(subscriptions):
+        if subscription.user_id != uid:
+            results.append(BulkItemResult(index=index, status_code=403, detail=BULK_DETAILS[403]))
+        else:
+            accepted.append((index, {**subscription.dict(), "created_at": now, "updated_at": now}))
+
+    created = await subscription_repo.bulk_create(uid, [data for _, data in accepted])
+    for (index, data), (code, subscription_id) in zip(accepted, created):
+        results.append(BulkItemResult(
+            index=index,
+            status_code=code,
+            subscription_id=subscription_id,
+            detail=BULK_DETAILS.get(code),
+            subscription={**data, "subscription_id": subscription_id} if code == 201 else None
+        ))
+    return bulk_results_json(sorted(results, key=lambda result: result.index))
+
+@app.put("/api/subscriptions/bulk", response_model=List[BulkItemResult])
+async def bulk_update_subscriptions(
+    subscriptions: List[BulkSubscriptionUpdate],
+    decoded_token: dict = Depends(verify_firebase_token)
+):
+    check_bulk_size(subscriptions)
+    check_unique_ids([subscription.subscription_id for subscription in subscriptions])
+    uid = decoded_token['uid']
+    now = datetime.now()
+    updates = {
+        subscription.subscription_id: {**subscription.dict(exclude={"subscription_id"}), "updated_at": now}
+        for subscription in subscriptions if subscription.user_id == uid
+    }
+    outcomes = await subscription_repo.bulk_update(uid, updates)
+
+    results = []
+    for index, subscription in enumerate(subscriptions):
+        code, data = outcomes.get(subscription.subscription_id, (403, None))
+        results.append(BulkItemResult(
+            index=index,
+            status_code=code,
+            subscription_id=subscription.subscription_id,
+            detail=BULK_DETAILS.get(code),
+            subscription=data
+        ))
+    return bulk_results_json(results)
+
+@app.post("/api/subscriptions/bulk-delete", response_model=List[BulkItemResult])
+async def bulk_delete_subscriptions(
+    request: BulkDeleteRequest,
+    decoded_token: dict = Depends(verify_firebase_token)
+):
+    check_bulk_size(request.subscription_ids)
+    check_unique_ids(request.subscription_ids)
+    outcomes = await subscription_repo.bulk_delete(decoded_token['uid'], request.subscription_ids)
+    return bulk_results_json([
+        BulkItemResult(
+            index=index,
+            status_code=outcomes[subscription_id],
+            subscription_id=subscription_id,
+            detail=BULK_DETAILS.get(outcomes[subscription_id])
+        )
+        for index, subscription_id in enumerate(request.subscription_ids)
+    ])
+
+WRITE_ERRORS = {
+    404: "Resource not found",
+    409: "Modified concurrently, retry",
+    412: "Resource version does not match If-Match",
+}
 
 @app.get("/api/subscriptions/{subscription_id}", response_model=SubscriptionResponse)
-async def get_subscription(subscription_id: str, decoded_token: dict = Depends(verify_firebase_token)):
-    doc = db.collection('subscriptions').document(subscription_id).get()
-    if not doc.exists or doc.to_dict()['user_id'] != decoded_token['uid']:
+async def get_subscription(
+    subscription_id: str,
+    if_none_match: Optional[str] = Header(None),
+    decoded_token: dict = Depends(verify_firebase_token)
+):
+    sub = await subscription_repo.get_for_user(subscription_id, decoded_token['uid'])
+    if not sub:
         raise HTTPException(status_code=404, detail="Resource not found")
-    return {**doc.to_dict(), "subscription_id": doc.id}
+    etag = subscription_version(sub)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return subscription_json(sub)
 
 @app.post("/api/subscriptions", response_model=SubscriptionResponse)
 async def create_subscription(
@@ -525,26 +2671,21 @@ async def create_subscription(
         raise HTTPException(status_code=403, detail="Access denied")
     
     now = datetime.now()
-    doc_ref = db.collection('subscriptions').document()
     subscription_data = {
         **subscription.dict(),
         "created_at": now,
         "updated_at": now
     }
-    doc_ref.set(subscription_data)
-    return {**subscription_data, "subscription_id": doc_ref.id}
+    subscription_id = await subscription_repo.create(subscription_data)
+    return subscription_json({**subscription_data, "subscription_id": subscription_id})
 
 @app.put("/api/subscriptions/{subscription_id}", response_model=SubscriptionResponse)
 async def update_subscription(
     subscription_id: str,
     subscription: Subscription,
+    if_match: Optional[str] = Header(None),
     decoded_token: dict = Depends(verify_firebase_token)
 ):
-    doc_ref = db.collection('subscriptions').document(subscription_id)
-    doc = doc_ref.get()
-    
-    if not doc.exists or doc.to_dict()['user_id'] != decoded_token['uid']:
-        raise HTTPException(status_code=404, detail="Resource not found")
     if decoded_token['uid'] != subscription.user_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
@@ -552,21 +2693,22 @@ async def update_subscription(
         **subscription.dict(),
         "updated_at": datetime.now()
     }
-    doc_ref.update(update_data)
-    return {**doc_ref.get().to_dict(), "subscription_id": subscription_id}
+    code, sub = await subscription_repo.update(subscription_id, decoded_token['uid'], update_data, if_match)
+    if code != 200:
+        raise HTTPException(status_code=code, detail=WRITE_ERRORS[code])
+    return subscription_json(sub)
 
 @app.delete("/api/subscriptions/{subscription_id}")
 async def delete_subscription(
     subscription_id: str,
+    if_match: Optional[str] = Header(None),
     decoded_token: dict = Depends(verify_firebase_token)
 ):
-    doc_ref = db.collection('subscriptions').document(subscription_id)
-    doc = doc_ref.get()
-    
-    if not doc.exists or doc.to_dict()['user_id'] != decoded_token['uid']:
+    code = await subscription_repo.delete(subscription_id, decoded_token['uid'], if_match)
+    if code == 404:
         raise HTTPException(status_code=404, detail="Subscription not found")
-    
-    doc_ref.delete()
+    if code != 200:
+        raise HTTPException(status_code=code, detail=WRITE_ERRORS[code])
     return {"message": "Subscription deleted successfully"}
 
 @app.get("/api/subscriptions/total/{user_id}")
@@ -577,15 +2719,7 @@ async def get_monthly_total(
     if decoded_token['uid'] != user_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    monthly_total = 0.0
-    docs = db.collection('subscriptions') \
-        .where('user_id', '==', user_id) \
-        .where('status', '==', 'Active').stream()
-    
-    for doc in docs:
-        sub = doc.to_dict()
-        monthly_total += sub['cost'] / (12 if sub['billing_cycle'] == 'Yearly' else 1)
-            
+    monthly_total = await subscription_repo.get_monthly_total(user_id)
     return {"total": round(monthly_total, 2)}
 
 @app.exception_handler(HTTPException)
@@ -593,7 +2727,48 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     response = JSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail},
+        headers=exc.headers,
     )
     if exc.status_code == 401:
         response.headers["WWW-Authenticate"] = "Bearer"
-    return response 
\ No newline at end of file
+    return response
+
+@app.exception_handler(DependencyTimeout)
+async def dependency_timeout_handler(request: Request, exc: DependencyTimeout):
+    return JSONResponse(status_code=504, content={"detail": "Upstream service timed out"})
+
+@app.exception_handler(DependencyUnavailable)
+async def dependency_unavailable_handler(request: Request, exc: DependencyUnavailable):
+    return JSONResponse(status_code=503, content={"detail": "Upstream service unavailable"})
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Upstream service unavailable"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+# Maintenance commands, e.g. `python main.py rebuild-totals [--user-id UID]`
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SubTrack maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild-totals", help="Recompute subscription_totals docs")
+    rebuild.add_argument("--user-id", help="Only rebuild this user's totals")
+    commands.add_parser("backfill-renewals", help="Add renewal_at to subscriptions written before it existed")
+    commands.add_parser("process-renewals", help="Roll due renewal dates and queue reminders once, as processRenewals does hourly")
+    fleet = commands.add_parser("fleet-analytics", help="Print fleet-wide spending aggregates as JSON")
+    fleet.add_argument("--chunk-size", type=int, default=ANALYTICS_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "rebuild-totals":
+        written = asyncio.run(subscription_repo.rebuild_totals(args.user_id))
+        print(f"Rebuilt {written} totals document(s)")
+    elif args.command == "backfill-renewals":
+        updated, undated = asyncio.run(subscription_repo.backfill_renewal_at())
+        print(f"Added renewal_at to {updated} subscription(s), null for {undated} without a valid date")
+    elif args.command == "process-renewals":
+        processed = asyncio.run(renewal_scheduler.run_once())
+        print(f"Processed {processed} renewal event(s)")
+    elif args.command == "fleet-analytics":
+        print(dump_json(asyncio.run(fleet_analytics(args.chunk_size))).decode())